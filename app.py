@@ -1,7 +1,6 @@
 from asyncio import QueueEmpty
 import logging
 import os
-import pandas as pd
 from telegram import ReplyKeyboardRemove, Update
 from telegram.ext import (
     Updater,
@@ -12,16 +11,16 @@ from telegram.ext import (
     ConversationHandler,
     CallbackContext,
 )
-import src.credentials
+from hh_research.src.currency_exchange import Exchanger
+from hh_research.src.metrics import serve_metrics
+from src.analysis import start_precompute
 from src.filters import FilterEducation, FilterAge
 from src.respond_logic import (
     age, gender, info, invalid_age, simple_test_q1, simple_test_q2, simple_test_res, start, start_dialog, options,
-    education, job_sphere, cancel, analyze, vacancy
+    education, job_sphere, cancel, analyze, vacancy, SEARCHABLE_SPHERES
 )
 
 START, GENDER, AGE, EDUCATION, JOB_SPHERE, OPTIONS, Q2, SIMPLE_TEST_PASSED, VACANCY = range(9)
-PROF_MATRIX = pd.read_excel('https://raw.githubusercontent.com/harbachonakk/files-for-heroku/main/professions_matrix.xlsx',
-                            header=0)
 
 filter_age = FilterAge()
 filter_education = FilterEducation()
@@ -42,6 +41,9 @@ def location(update: Update, context: CallbackContext) -> int:
 
 
 if __name__ == "__main__":
+    # Plot workers re-import this module, only the bot needs credentials
+    import src.credentials
+
     token = src.credentials.TOKEN
     name = src.credentials.NAME
 
@@ -53,6 +55,16 @@ if __name__ == "__main__":
                         level=logging.INFO)
     logger = logging.getLogger(__name__)
 
+    # Prometheus metrics next to the webhook, Heroku routes only PORT so it is optional
+    METRICS_PORT = os.environ.get('METRICS_PORT')
+    if METRICS_PORT:
+        serve_metrics(int(METRICS_PORT))
+
+    # Keep exchange rates fresh outside of user requests
+    scheduler = Exchanger(params={}).start_background_refresh(interval=3600)
+    # Reports for spheres and popular requests are ready before users ask
+    start_precompute(SEARCHABLE_SPHERES, scheduler=scheduler)
+
     # Set up the Updater
     updater = Updater(token)
     dp = updater.dispatcher
@@ -11,9 +11,13 @@ Description   :
 ------------------------------------------------------------------------
 """
 
+import asyncio
 import json
 import sys
-from typing import Dict, Optional
+import threading
+import time
+from itertools import combinations
+from typing import Callable, Dict, List, Optional, Sequence, Set, Union
 import os
 import logging
 """
@@ -28,46 +32,337 @@ from hh_research.src.parser import Settings_Parser
 from hh_research.src.collector import Collector
 from hh_research.src.currency_exchange import Exchanger
 from hh_research.src.analyzer import Analyzer
+from hh_research.src.cache import SnapshotStore, VacancyCache
+from hh_research.src.http_session import configure_session
+from hh_research.src.metrics import METRICS
+from hh_research.src.stats import RunningStats
+from hh_research.src.vacancy import Vacancy
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 # CACHE_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "cache")
 CACHE_DIR = "hh_research\src\cache"
 SETTINGS_PATH = "hh_research\settings.json"
+VACANCY_CACHE_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "src", "cache", "vacancies")
+SNAPSHOT_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "src", "cache", "snapshots")
 
 logger = logging.getLogger(__name__)
 
+# One cache per process: its LRU index is shared by all researchers
+_vacancy_cache: Optional[VacancyCache] = None
+_snapshot_store: Optional[SnapshotStore] = None
+# Researchers are updated at once by the precompute scheduler and the analysis workers
+_stores_lock = threading.Lock()
+
+
+def get_vacancy_cache(ttl: float = 6 * 3600, max_entries: int = 20000) -> VacancyCache:
+    """Return process-wide vacancy cache, create it on the first call."""
+    global _vacancy_cache
+    with _stores_lock:
+        if _vacancy_cache is None:
+            _vacancy_cache = VacancyCache(VACANCY_CACHE_DIR, ttl=ttl, max_entries=max_entries)
+            METRICS.register("vacancy_cache_hits_total", lambda: _vacancy_cache.hits,
+                             "Vacancies taken from cache", kind="counter")
+            METRICS.register("vacancy_cache_misses_total", lambda: _vacancy_cache.misses,
+                             "Vacancies missing in cache", kind="counter")
+            METRICS.register("vacancy_cache_entries", lambda: len(_vacancy_cache), "Vacancies in cache")
+        return _vacancy_cache
+
+
+def get_snapshot_store() -> SnapshotStore:
+    """Return process-wide store of search snapshots."""
+    global _snapshot_store
+    with _stores_lock:
+        if _snapshot_store is None:
+            _snapshot_store = SnapshotStore(SNAPSHOT_DIR)
+        return _snapshot_store
+
+
+def overlap_summary(names: Sequence[str], ids: Sequence[Set[str]]) -> Dict:
+    """Overlap of vacancy ids between searches.
+
+    Returns
+    -------
+    dict
+        {"listed": total number of vacancies of all searches,
+        "distinct": number of distinct vacancies,
+        "pairs": {(name_a, name_b): {"common": int, "jaccard": float}}}
+
+    """
+    pairs = {}
+    for (name_a, ids_a), (name_b, ids_b) in combinations(zip(names, ids), 2):
+        common = len(ids_a & ids_b)
+        union = len(ids_a | ids_b)
+        pairs[(name_a, name_b)] = {"common": common, "jaccard": common / union if union else 0.0}
+    return {
+        "listed": sum(len(el) for el in ids),
+        "distinct": len(set().union(*ids)),
+        "pairs": pairs,
+    }
+
+
+class Progress:
+    """Running salary statistics of collected vacancies.
+
+    `callback(progress)` is called at most once per `interval` seconds
+    while vacancies arrive. Salaries are converted to RUB with `rates`.
+    """
+
+    def __init__(self, callback: Callable[["Progress"], None], rates: Dict, interval: float = 5.0):
+        self.callback = callback
+        self.rates = rates
+        self.interval = interval
+        self.collected = 0
+        self.salaries = RunningStats()
+        self._last_call = time.monotonic()
+
+    def __call__(self, job: Vacancy):
+        self.collected += 1
+        salary = job.average_salary(self.rates)
+        if salary is not None:
+            self.salaries.add(salary)
+        now = time.monotonic()
+        if now - self._last_call >= self.interval:
+            self._last_call = now
+            try:
+                self.callback(self)
+            except Exception as e:
+                logger.warning(f"[WARN]: Progress callback failed: {e}")
+
 
 class Researcher:
     """Main class for searching vacancies and analyze them."""
 
     def __init__(self, configs: str = None, settings_dict: Dict = None, no_parse: bool = False):
         self.settings_dict = settings_dict
+        configure_session(
+            pool_size=settings_dict.get('pool_size', 10),
+            retries=settings_dict.get('retries', 3),
+            backoff_factor=settings_dict.get('backoff_factor', 0.5))
 
         # self.settings_pars = Settings_Parser(configs, no_parse=no_parse)
-        self.exchanger = Exchanger(params=settings_dict)
+        self.exchanger = Exchanger(params=settings_dict, rates_ttl=settings_dict.get('rates_ttl', 12 * 3600))
         self.collector: Optional[Collector] = None
         self.analyzer: Optional[Analyzer] = None
         self.predictor = Predictor()
+        self.vacancies: Optional[Dict] = None
+        self.has_details = False
 
     def update(self, **kwargs):
         # self.settings.update_params(**kwargs)
         # if not any(self.settings_dict['rates'].values()) or self.settings_dict['update']:
-        logger.info(
-            "[INFO]: Trying to get exchange rates from remote server...")
-        print("[INFO]: Trying to get exchange rates from remote server...")
-        self.settings_dict['rates'] = self.exchanger.update_exchange_rates(
-            self.settings_dict['rates'])
+        # Rates are refreshed in background, see Exchanger.start_background_refresh
+        with METRICS.timer("rates"):
+            self.settings_dict['rates'] = self.exchanger.get_rates(
+                self.settings_dict['rates'])
         # self.exchanger.save_rates(self.settings.rates)
 
         logger.info(
             f"[INFO]: Get exchange rates: {self.settings_dict['rates']}")
         print(f"[INFO]: Get exchange rates: {self.settings_dict['rates']}")
-        self.collector = Collector(self.settings_dict['rates'])
+        cache = get_vacancy_cache(
+            ttl=self.settings_dict.get('cache_ttl', 6 * 3600),
+            max_entries=self.settings_dict.get('cache_size', 20000))
+        self.collector = Collector(cache=cache, snapshots=get_snapshot_store(),
+                                   compress=self.settings_dict.get('compress_descriptions', False))
         # self.analyzer=Analyzer(self.settings.save_result)
         self.analyzer = Analyzer(save_csv=False)
 
-    def __call__(self):
+    def __call__(self, fast: Optional[bool] = None, progress: Optional[Callable[[Progress], None]] = None):
+        """Collect vacancies and make a report.
+
+        Parameters
+        ----------
+        fast : bool
+            Use search items only: salary statistics without key skills and
+            full descriptions. Default is `settings_dict['fast']`. Call
+            `details` afterwards to get the full report. With
+            `settings_dict['incremental']` a query with a snapshot is
+            updated in full instead, see `has_details`.
+        progress : callable
+            Gets `Progress` with partial statistics while vacancies are
+            collected, every `settings_dict['progress_interval']` seconds.
+
+        """
+        if fast is None:
+            fast = self.settings_dict.get('fast', False)
+        incremental = self.settings_dict.get('incremental') and not self.settings_dict['refresh']
+        if fast and incremental and self.collector.has_snapshot(self.settings_dict['options']):
+            # Only new vacancies are fetched, the rest are in the vacancy cache
+            fast = False
+        on_vacancy = self._progress(progress)
+        logger.info(
+            "[INFO]: Collect data from JSON. Create list of vacancies...")
+        # Detail fetches of full modes overlap with listing, they are timed as one stage
+        stage = "listing" if fast else "collect"
+        # Timed locally too: METRICS keeps the last run of any Researcher
+        start = time.perf_counter()
+        with METRICS.timer(stage):
+            if fast:
+                vacancies = self.collector.collect_listing(
+                    query=self.settings_dict['options'], max_workers=self.settings_dict['max_workers'],
+                    on_vacancy=on_vacancy, snapshot=incremental)
+            elif incremental:
+                vacancies = self.collector.collect_vacancies_incremental(
+                    query=self.settings_dict['options'], max_workers=self.settings_dict['max_workers'],
+                    on_vacancy=on_vacancy)
+            elif self.settings_dict.get('engine') == 'async':
+                vacancies = asyncio.run(self.collector.collect_vacancies_async(
+                    query=self.settings_dict['options'], refresh=self.settings_dict['refresh'],
+                    max_concurrency=self.settings_dict.get('max_concurrency', 100), on_vacancy=on_vacancy
+                ))
+            else:
+                vacancies = self.collector.collect_vacancies(
+                    query=self.settings_dict['options'], refresh=self.settings_dict[
+                        'refresh'], max_workers=self.settings_dict['max_workers'], on_vacancy=on_vacancy
+                )
+        self._count_vacancies(vacancies, stage, time.perf_counter() - start)
+        self.vacancies = vacancies
+        self.has_details = not fast
+        return self._report(vacancies, plot=not fast, predict=not fast, train=not fast)
+
+    def details(self, progress: Optional[Callable[[Progress], None]] = None):
+        """Full report for the last fast call: fetch key skills and descriptions."""
+        if self.vacancies is None or self.has_details:
+            return self._report(self.vacancies)
+        logger.info("[INFO]: Get details for listed vacancies...")
+        on_vacancy = self._progress(progress)
+        start = time.perf_counter()
+        with METRICS.timer("details"):
+            if self.settings_dict.get('engine') == 'async':
+                self.vacancies = asyncio.run(self.collector.fill_details_async(
+                    self.vacancies, refresh=self.settings_dict['refresh'],
+                    max_concurrency=self.settings_dict.get('max_concurrency', 100), on_vacancy=on_vacancy
+                ))
+            else:
+                self.vacancies = self.collector.fill_details(
+                    self.vacancies, refresh=self.settings_dict['refresh'],
+                    max_workers=self.settings_dict['max_workers'], on_vacancy=on_vacancy)
+        self._count_vacancies(self.vacancies, "details", time.perf_counter() - start)
+        self.has_details = True
+        return self._report(self.vacancies)
+
+    @staticmethod
+    def _count_vacancies(vacancies, stage: str, seconds: float):
+        num = vacancies.size if vacancies is not None else 0
+        METRICS.inc("vacancies_collected", num)
+        if seconds > 0:
+            METRICS.set(f"{stage}_vacancies_per_second", num / seconds)
+
+    def compare(self, queries: List[Union[str, Dict]], plot: bool = False,
+                progress: Optional[Callable[[Progress], None]] = None) -> Dict:
+        """Reports for several searches, e.g. roles to compare.
+
+        Searches are listed concurrently and every distinct vacancy is
+        fetched once, so overlapping searches are much cheaper than
+        separate calls.
+
+        Parameters
+        ----------
+        queries : list
+            Search texts or full query params. Texts are combined with
+            `settings_dict['options']`.
+        plot : bool
+            Render salary charts for every search.
+        progress : callable
+            Gets `Progress` over distinct vacancies.
+
+        Returns
+        -------
+        dict
+            {"reports": {name: report tuple as in `__call__`},
+            "overlap": `overlap_summary` of the searches}
+
+        """
+        queries = [dict(self.settings_dict['options'], text=query) if isinstance(query, str) else query
+                   for query in queries]
+        names = [query.get('text', '') for query in queries]
+        with METRICS.timer("compare"):
+            vacancies_list = self.collector.collect_many(
+                queries, refresh=self.settings_dict['refresh'], max_workers=self.settings_dict['max_workers'],
+                on_vacancy=self._progress(progress))
+        ids = [set(vacancies["Ids"]) if vacancies is not None else set() for vacancies in vacancies_list]
+        overlap = overlap_summary(names, ids)
+        METRICS.inc("vacancies_collected", overlap["distinct"])
+        return {
+            "reports": {name: self._report(vacancies, plot=plot, predict=False)
+                        for name, vacancies in zip(names, vacancies_list)},
+            "overlap": overlap,
+        }
+
+    def reprice(self):
+        """Report for the last collected vacancies with current exchange rates.
+
+        Raw salaries are kept, so nothing is fetched again.
+        """
+        self.settings_dict['rates'] = self.exchanger.get_rates(self.settings_dict['rates'])
+        return self._report(self.vacancies, plot=self.has_details, predict=self.has_details, train=False)
+
+    def _progress(self, callback: Optional[Callable[[Progress], None]]) -> Optional[Progress]:
+        if callback is None:
+            return None
+        return Progress(callback, self.settings_dict['rates'], interval=self.settings_dict.get('progress_interval', 5.0))
+
+    def _plot(self, df):
+        """Start rendering charts, None if the plot worker cannot take them."""
+        start = time.perf_counter()
+        try:
+            chart_future = self.analyzer.plot_df(df)
+        except Exception as e:
+            logger.warning(f"[WARN]: Cannot plot results: {e}")
+            return None
+        chart_future.add_done_callback(lambda _: METRICS.observe("plot", time.perf_counter() - start))
+        return chart_future
+
+    def _predict(self, df, predict: bool, train: bool) -> Optional[str]:
+        """Update the shared salary model and predict missing salaries.
+
+        Only full reports should train the model: search snippets are not
+        the descriptions it is trained on.
+
+        Returns
+        -------
+        str
+            Summary of predicted salaries or None.
+
+        """
+        try:
+            if train:
+                self.predictor.update(df)
+            if not predict:
+                return None
+            total_df = self.predictor.predict(df)
+        except Exception as e:
+            logger.warning(f"[WARN]: Cannot predict salaries: {e}")
+            return None
+        # self.predictor.plot_results(total_df)
+        if total_df is None:
+            return None
+        return ("Прогноз медианной зарплаты для %d вакансий без вилки   : %d RUB"
+                % (len(total_df), total_df["Average"].median()))
+
+    def _report(self, vacancies: Optional[Dict], plot: bool = True, predict: bool = True, train: bool = True):
+        """Analyze vacancies.
+
+        Parameters
+        ----------
+        plot : bool
+            Render salary charts.
+        predict : bool
+            Predict salaries of vacancies without salary.
+        train : bool
+            Update the salary model with vacancies with salary.
+
+        Returns
+        -------
+        tuple
+            (num_of_vacancies, max_salary, min_salary, mean_salary,
+            median_salary, most_keys, most_words, chart, predicted_salary),
+            chart is PNG bytes or None, predicted_salary is a summary of
+            predicted salaries or None. All values are None if there are
+            no vacancies.
+
+        """
         num_of_vacancies = None
         max_salary = None 
         min_salary = None 
@@ -75,27 +370,35 @@ class Researcher:
         median_salary = None 
         most_keys = None
         most_words = None
-        logger.info(
-            "[INFO]: Collect data from JSON. Create list of vacancies...")
-        vacancies = self.collector.collect_vacancies(
-            query=self.settings_dict['options'], refresh=self.settings_dict[
-                'refresh'], max_workers=self.settings_dict['max_workers']
-        )
+        chart = None
+        predicted_salary = None
         if vacancies is not None:
             logger.info("[INFO]: Prepare dataframe...")
-            df = self.analyzer.prepare_df(vacancies)
+            with METRICS.timer("prepare_df"):
+                df = self.analyzer.prepare_df(vacancies, self.settings_dict['rates'])
+            # Charts are drawn in another process while this one analyzes
+            chart_future = self._plot(df) if plot else None
             logger.info("\n[INFO]: Analyze dataframe...")
-            num_of_vacancies, max_salary, min_salary, mean_salary, median_salary, most_keys, most_words = self.analyzer.analyze_df(df)
-            logger.info("\n[INFO]: Predict None salaries...")
-            # total_df = self.predictor.predict(df)
-            # self.predictor.plot_results(total_df)
+            with METRICS.timer("analyze_df"):
+                num_of_vacancies, max_salary, min_salary, mean_salary, median_salary, most_keys, most_words = self.analyzer.analyze_df(df)
+            if chart_future is not None:
+                try:
+                    chart = chart_future.result(timeout=self.settings_dict.get('plot_timeout', 60))
+                except Exception as e:
+                    logger.warning(f"[WARN]: Cannot plot results: {e}")
+            if predict or train:
+                logger.info("\n[INFO]: Predict None salaries...")
+                with METRICS.timer("predict"):
+                    predicted_salary = self._predict(df, predict=predict, train=train)
             logger.info("[INFO]: Done! Exit()")
             print("[INFO]: Done! Exit()")
             
         else:
+            METRICS.inc("empty_reports")
             logger.info("[FAIL] No vacancies found on such request")
             print("[FAIL] No vacancies found on such request")
-        return num_of_vacancies, max_salary, min_salary, mean_salary, median_salary, most_keys, most_words
+        return (num_of_vacancies, max_salary, min_salary, mean_salary, median_salary, most_keys, most_words, chart,
+                predicted_salary)
 
 """
 if __name__ == "__main__":
@@ -3,34 +3,59 @@ r"""Researcher: collect statistics, predict salaries etc.
 ------------------------------------------------------------------------
 """
 
-import re
-from typing import Dict, List
+import itertools
+from collections import Counter
+from concurrent.futures import Future
+from typing import Dict, Iterable, List, Optional, Union
 
-import matplotlib.pyplot as plt
-import nltk
 import numpy as np
 import pandas as pd
-import seaborn as sns
 import logging
 
+from hh_research.src.columns import VacancyColumns
+from hh_research.src.plotter import submit_salary_plots
+from hh_research.src.salary import normalize_salaries
+from hh_research.src.text import get_stop_words, iter_tokens
+
 logger = logging.getLogger(__name__)
 
 class Analyzer:
     def __init__(self, save_csv: bool = False):
         self.save_csv = save_csv
-        # try:
-        #     nltk.download("stopwords")
-        # except:
-        #     print(r"[INFO] You have downloaded stopwords!")
 
     @staticmethod
-    def find_top_words_from_keys(keys_list: List) -> pd.Series:
+    def count_top(words: Iterable[str], top: Optional[int] = None, name: Optional[str] = None) -> pd.Series:
+        """Count words in one pass and select the most frequent ones.
+
+        Parameters
+        ----------
+        words : iterable
+            Words to count.
+        top : int
+            Number of most frequent words to return, all words if None.
+            Selection uses a heap: O(n log top) instead of a full sort.
+        name : str
+            Name of the series.
+
+        Returns
+        -------
+        pd.Series
+            {Word: Count} sorted by count in descending order.
+
+        """
+        most_common = Counter(words).most_common(top)
+        return pd.Series(dict(most_common), name=name, dtype="int64")
+
+    @staticmethod
+    def find_top_words_from_keys(keys_list: List, top: Optional[int] = None) -> pd.Series:
         """Find most used words into description of vacancies.
 
         Parameters
         ----------
         keys_list : list
             List of sentences from keywords of vacancies.
+        top : int
+            Number of keywords to return, all if None.
 
         Returns
         -------
@@ -38,31 +63,40 @@ class Analyzer:
             List of sorted keywords.
 
         """
-        # List of keys for all vacancies
-        lst_keys = []
-        for keys_elem in keys_list:
-            for el in keys_elem:
-                if el != "":
-                    lst_keys.append(re.sub("'", "", el.lower()))
-
-        # Unique keys and their counter
-        set_keys = set(lst_keys)
-        # Dict: {Key: Count}
-        dct_keys = {el: lst_keys.count(el) for el in set_keys}
-        # Sorted dict
-        srt_keys = dict(
-            sorted(dct_keys.items(), key=lambda x: x[1], reverse=True))
-        # Return pandas series
-        return pd.Series(srt_keys, name="Keys")
+        # Keys for all vacancies
+        lst_keys = (el.lower().replace("'", "") for keys_elem in keys_list for el in keys_elem if el != "")
+        return Analyzer.count_top(lst_keys, top, name="Keys")
 
     @staticmethod
-    def find_top_words_from_description(desc_list: List) -> pd.Series:
+    def find_top_words_from_description(desc_list: List, top: Optional[int] = None) -> pd.Series:
         """Find most used words into description of vacancies.
 
         Parameters
         ----------
         desc_list : list
             List of sentences from vacancy description.
+        top : int
+            Number of words to return, all if None.
+
+        Returns
+        -------
+        pd.Series
+            List of sorted words from descriptions.
+
+        """
+        # Pandas series - {Word: Counter}, without 'stop words'
+        return Analyzer.count_top(iter_tokens(desc_list, get_stop_words()), top)
+
+    @staticmethod
+    def find_top_words_from_tokens(tokens_list: Iterable[List[str]], top: Optional[int] = None) -> pd.Series:
+        """Find most used words of descriptions tokenized by `Collector`.
+
+        Parameters
+        ----------
+        tokens_list : iterable
+            Words of every vacancy description, stop words are removed.
+        top : int
+            Number of words to return, all if None.
 
         Returns
         -------
@@ -70,47 +104,39 @@ class Analyzer:
             List of sorted words from descriptions.
 
         """
-        words_ls = " ".join(
-            [re.sub(" +", " ", re.sub(r"\d+", "", el.strip().lower())) for el in desc_list])
-        # Find all words
-        words_re = re.findall("[a-zA-Z]+", words_ls)
-        # Filter words with length < 3
-        words_l2 = [el for el in words_re if len(el) > 2]
-        # Unique words
-        words_st = set(words_l2)
-        # Remove 'stop words'
-        try:
-            _ = nltk.corpus.stopwords.words("english")
-        except LookupError:
-            nltk.download("stopwords")
-        finally:
-            stop_words = set(nltk.corpus.stopwords.words("english"))
-
-        # XOR for dictionary
-        words_st ^= stop_words
-        words_st ^= {"amp", "quot"}
-        # Dictionary - {Word: Counter}
-        words_cnt = {el: words_l2.count(el) for el in words_st}
-        # Pandas series
-        return pd.Series(dict(sorted(words_cnt.items(), key=lambda x: x[1], reverse=True)))
-
-    def prepare_df(self, vacancies: Dict) -> pd.DataFrame:
+        return Analyzer.count_top(itertools.chain.from_iterable(tokens_list), top)
+
+    def prepare_df(self, vacancies: Union[VacancyColumns, Dict], rates: Dict) -> pd.DataFrame:
         """Prepare data frame and save results
 
         Parameters
         ----------
-        vacancies: dict
-            Dict of parsed vacancies.
+        vacancies: VacancyColumns or dict
+            Columns of parsed vacancies with raw salaries.
+        rates: dict
+            Exchange rates, From and To are converted to net RUB with them.
+            Raw columns are not changed, so the same vacancies can be
+            prepared again with new rates.
 
         """
 
         # Create pandas dataframe
-        df = pd.DataFrame.from_dict(vacancies)
-        # Print some info from data frame
-        with pd.option_context("display.max_rows", None, "display.max_columns", None):
-            #print(df[df["Salary"]][["Employer", "From", "To", "Experience"]][0:15])
-            logging.info('dataframe - {}'.format((df[df["Salary"]][["Employer", "From", "To", "Experience"]][0:15]).to_string()))
-            print(df[df["Salary"]][["Employer", "From", "To", "Experience"]][0:15])
+        if isinstance(vacancies, VacancyColumns):
+            df = vacancies.to_frame()
+        else:
+            df = pd.DataFrame.from_dict(vacancies)
+        df["From"], df["To"] = normalize_salaries(
+            [df["From"].to_numpy(dtype=float), df["To"].to_numpy(dtype=float)],
+            df["Currency"], df["Gross"].to_numpy(dtype=bool), rates)
+        unknown = df["Salary"] & df["From"].isna() & df["To"].isna()
+        if unknown.any():
+            logger.warning("[WARN]: No exchange rate for {} vacancies: {}".format(
+                unknown.sum(), sorted(df.loc[unknown, "Currency"].dropna().unique())))
+        # Print some info from data frame, formatting is skipped unless debugging
+        if logger.isEnabledFor(logging.DEBUG):
+            with pd.option_context("display.max_rows", None, "display.max_columns", None):
+                #print(df[df["Salary"]][["Employer", "From", "To", "Experience"]][0:15])
+                logger.debug('dataframe - {}'.format((df[df["Salary"]][["Employer", "From", "To", "Experience"]][0:15]).to_string()))
         # Save to file
         if self.save_csv:
             #print("\n\n[INFO]: Save dataframe to file...")
@@ -118,35 +144,49 @@ class Analyzer:
             df.to_csv("hh_results.csv", index=False)
         return df
 
+    @staticmethod
+    def plot_df(df: pd.DataFrame) -> Future:
+        """Render salary plots of data frame in a worker process
+
+        Returns
+        -------
+        Future
+            Future with PNG bytes.
+
+        """
+        logging.info("\n[INFO]: Plot results...")
+        return submit_salary_plots(df["From"].to_numpy(dtype=float), df["To"].to_numpy(dtype=float))
+
     def analyze_df(self, df: pd.DataFrame):
         """Load data frame and analyze results
 
         """
-        sns.set()
         # with pd.option_context('display.max_rows', None, 'display.max_columns', None):
         #print(df[df["Salary"]][0:7])
-        logging.info('dataframe - {}'.format((df[df["Salary"]][0:7]).to_string()))
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug('dataframe - {}'.format((df[df["Salary"]][0:7]).to_string()))
         #print("\nNumber of vacancies: {}".format(df["Ids"].count()))
         
         num_of_vacancies = df["Ids"].count()
         logging.info("\nNumber of vacancies: {}".format(num_of_vacancies))
 
-        logging.info("\nVacancy with max salary: ")
-        max_salary = df.iloc[df[["From", "To"]].idxmax()]
-        logging.info('dataframe - {}'.format(max_salary.to_string()))
-
-        min_salary = df.iloc[df[["From", "To"]].idxmin()]
-        #print(df.iloc[df[["From", "To"]].idxmax()])
-        logging.info("\nVacancy with min salary: ")
-        #print(df.iloc[df[["From", "To"]].idxmin()])
-        logging.info('dataframe - {}'.format(min_salary.to_string()))
-
-        logging.info("\n[INFO]: Describe salary data frame")
-        df_stat = df[["From", "To"]].dropna().describe().applymap(np.int32)
-        #df_stat = df[["From", "To"]].describe().astype('Int64')
-        #print(df_stat.iloc[list(range(4)) + [-1]])
-        logging.info('dataframe - {}'.format((df_stat.iloc[list(range(4)) + [-1]]).to_string()))
-        print(df_stat.iloc[list(range(4)) + [-1]])
+        if debug:
+            logger.debug("\nVacancy with max salary: ")
+            max_salary = df.iloc[df[["From", "To"]].idxmax()]
+            logger.debug('dataframe - {}'.format(max_salary.to_string()))
+
+            min_salary = df.iloc[df[["From", "To"]].idxmin()]
+            #print(df.iloc[df[["From", "To"]].idxmax()])
+            logger.debug("\nVacancy with min salary: ")
+            #print(df.iloc[df[["From", "To"]].idxmin()])
+            logger.debug('dataframe - {}'.format(min_salary.to_string()))
+
+            logger.debug("\n[INFO]: Describe salary data frame")
+            df_stat = df[["From", "To"]].dropna().describe().applymap(np.int32)
+            #df_stat = df[["From", "To"]].describe().astype('Int64')
+            #print(df_stat.iloc[list(range(4)) + [-1]])
+            logger.debug('dataframe - {}'.format((df_stat.iloc[list(range(4)) + [-1]]).to_string()))
         logging.info('\n[INFO]: Average statistics (filter for "From"-"To" parameters):')
         print('\n[INFO]: Average statistics (filter for "From"-"To" parameters):')
         comb_ft = np.nanmean(
@@ -163,46 +203,19 @@ class Analyzer:
 
         logging.info("\nMost frequently used words [Keywords]:")
         print("\nMost frequently used words [Keywords]:")
-        most_keys = self.find_top_words_from_keys(df["Keys"].to_list())
-        #print(most_keys[:12])
-        most_keys = most_keys[:12]
-        logging.info('dataframe - {}'.format(most_keys))
-        print(most_keys)
+        most_keys = self.find_top_words_from_keys(df["Keys"].to_list(), top=12)
+        if debug:
+            logger.debug('dataframe - {}'.format(most_keys))
 
         logging.info("\nMost frequently used words [Description]:")
         print("\nMost frequently used words [Description]:")
-        most_words = self.find_top_words_from_description(
-            df["Description"].to_list())
-        most_words = most_words[:12]
-        logging.info('dataframe - {}'.format(most_words))
-        print(most_words)
-
-        logging.info("\n[INFO]: Plot results. Close figure box to continue...")
-        fz = plt.figure("Salary plots", figsize=(12, 8))
-        fz.add_subplot(2, 2, 1)
-        plt.title("From / To: Boxplot")
-        sns.boxplot(data=df[["From", "To"]].dropna() / 1000, width=0.4)
-        plt.ylabel("Salary x 1000 [RUB]")
-        fz.add_subplot(2, 2, 2)
-        plt.title("From / To: Swarmplot")
-        sns.swarmplot(data=df[["From", "To"]].dropna() / 1000, size=6)
-
-        fz.add_subplot(2, 2, 3)
-        plt.title("From: Distribution ")
-        sns.distplot(df["From"].dropna() / 1000, bins=14, color="C0")
-        plt.grid(True)
-        plt.xlabel("Salary x 1000 [RUB]")
-        plt.xlim([-50, df["From"].max() / 1000])
-        plt.yticks([], [])
-
-        fz.add_subplot(2, 2, 4)
-        plt.title("To: Distribution")
-        sns.distplot(df["To"].dropna() / 1000, bins=14, color="C1")
-        plt.grid(True)
-        plt.xlim([-50, df["To"].max() / 1000])
-        plt.xlabel("Salary x 1000 [RUB]")
-        plt.yticks([], [])
-        plt.tight_layout()
+        if "Tokens" in df:
+            most_words = self.find_top_words_from_tokens(df["Tokens"], top=12)
+        else:
+            most_words = self.find_top_words_from_description(
+                df["Description"].to_list(), top=12)
+        if debug:
+            logger.debug('dataframe - {}'.format(most_words))
 
         return(num_of_vacancies, max_salary, min_salary, mean_salary, median_salary, most_keys, most_words)
 
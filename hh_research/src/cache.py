@@ -0,0 +1,202 @@
+r"""Vacancy cache: persistent per-vacancy storage with TTL and LRU eviction,
+snapshots of search results for incremental refresh
+
+------------------------------------------------------------------------
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: Dict) -> str:
+    """Canonical form of search options: same searches give the same string.
+
+    Text is lowercased and whitespace is collapsed, paging and date
+    filters are ignored.
+
+    """
+    options = {k: v for k, v in query.items() if k not in ("page", "date_from", "date_to")}
+    if "text" in options:
+        options["text"] = re.sub(r"\s+", " ", str(options["text"])).strip().lower()
+    return json.dumps(options, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def atomic_dump(obj, path: str):
+    """Pickle `obj` to `path` so that readers never see a partial file.
+
+    The object is written to a temporary file in the same directory and
+    then moved over the target with `os.replace`, which is atomic.
+
+    """
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            pickle.dump(obj, tmp, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class VacancyCache:
+    r"""Disk cache of raw vacancy JSON documents keyed by vacancy id
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory for cached documents. Created if it does not exist.
+    ttl : float
+        Time to live of a document in seconds.
+    max_entries : int
+        Maximum number of documents. Least recently used documents are
+        evicted when the limit is exceeded.
+
+    """
+
+    def __init__(self, cache_dir: str, ttl: float = 6 * 3600, max_entries: int = 20000):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # {vacancy_id: last access time}, oldest first
+        self._index: "OrderedDict[str, float]" = OrderedDict()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _path(self, vacancy_id: str) -> str:
+        return os.path.join(self.cache_dir, f"{vacancy_id}.pkl")
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".pkl"):
+                continue
+            try:
+                atime = os.stat(os.path.join(self.cache_dir, name)).st_mtime
+            except OSError:
+                continue
+            entries.append((atime, name[:-4]))
+        for atime, vacancy_id in sorted(entries):
+            self._index[vacancy_id] = atime
+
+    def get(self, vacancy_id: str) -> Optional[Dict]:
+        """Return cached vacancy or None if it is missing or expired."""
+        vacancy_id = str(vacancy_id)
+        path = self._path(vacancy_id)
+        try:
+            with open(path, "rb") as f:
+                saved_at, vacancy = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        now = time.time()
+        if now - saved_at > self.ttl:
+            self.delete(vacancy_id)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            self._index[vacancy_id] = now
+            self._index.move_to_end(vacancy_id)
+        try:
+            # mtime keeps the access order across restarts
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        return vacancy
+
+    def put(self, vacancy_id: str, vacancy: Dict):
+        """Save vacancy to the cache and evict old entries if needed."""
+        vacancy_id = str(vacancy_id)
+        now = time.time()
+        try:
+            atomic_dump((now, vacancy), self._path(vacancy_id))
+        except OSError as e:
+            logger.warning(f"[WARN]: Cannot cache vacancy {vacancy_id}: {e}")
+            return
+
+        with self._lock:
+            self._index[vacancy_id] = now
+            self._index.move_to_end(vacancy_id)
+            evicted = []
+            while len(self._index) > self.max_entries:
+                evicted.append(self._index.popitem(last=False)[0])
+        for old_id in evicted:
+            self._remove_file(old_id)
+
+    def delete(self, vacancy_id: str):
+        vacancy_id = str(vacancy_id)
+        with self._lock:
+            self._index.pop(vacancy_id, None)
+        self._remove_file(vacancy_id)
+
+    def _remove_file(self, vacancy_id: str):
+        try:
+            os.remove(self._path(vacancy_id))
+        except OSError:
+            pass
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, vacancy_id) -> bool:
+        return str(vacancy_id) in self._index
+
+
+class SnapshotStore:
+    r"""Last known search results per query
+
+    A snapshot is a dict: {"updated_at": str, "items": {id: published_at}}.
+    Vacancy documents themselves live in `VacancyCache`.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory for snapshots. Created if it does not exist.
+
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, query: Dict) -> str:
+        query_hash = hashlib.md5(normalize_query(query).encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{query_hash}.pkl")
+
+    def get(self, query: Dict) -> Optional[Dict]:
+        try:
+            with open(self._path(query), "rb") as f:
+                return pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError, ValueError):
+            return None
+
+    def put(self, query: Dict, snapshot: Dict):
+        try:
+            atomic_dump(snapshot, self._path(query))
+        except OSError as e:
+            logger.warning(f"[WARN]: Cannot save snapshot: {e}")
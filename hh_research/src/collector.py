@@ -3,47 +3,83 @@ r"""Vacancy finder
 ------------------------------------------------------------------------
 """
 
-import hashlib
+import asyncio
+import itertools
+import json
+import math
 import os
-import pickle
-import re
+import queue
+import threading
 from concurrent.futures import ThreadPoolExecutor
-from typing import Dict, Optional
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 from urllib.parse import urlencode
 import logging
 import requests
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
 from tqdm import tqdm
 
+from hh_research.src.cache import SnapshotStore, VacancyCache
+from hh_research.src.columns import VacancyColumns
+from hh_research.src.http_session import (
+    RETRY_STATUSES, STATS, backoff_delay, get_json, retry_settings
+)
+from hh_research.src.metrics import METRICS
+from hh_research.src.text import clean_tags, get_stop_words, tokenize
+from hh_research.src.vacancy import COLUMNS, Vacancy
+
 CACHE_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "cache")
 
 logger = logging.getLogger(__name__)
 
+# Called with every collected vacancy, e.g. for progress reports
+VacancyCallback = Optional[Callable[[Vacancy], None]]
+
+# End of stream marker for pipeline queues
+_DONE = object()
+
+# tornado reports timeouts and dropped connections as code 599
+ASYNC_RETRY_STATUSES = RETRY_STATUSES + (599,)
+
 
 class Collector:
     r"""Researcher parameters
 
+    Salaries are kept raw: From and To in the vacancy currency, see
+    `salary.normalize_salaries` for conversion to RUB.
+
     Parameters
     ----------
-    exchange_rates : dict
-        Dict of exchange rates: RUR, USD, EUR.
+    cache : VacancyCache
+        Optional disk cache of vacancy documents.
+    api_url : str
+        Base URL of vacancies API. Default is hh.ru, override it to use
+        a stub server.
+    snapshots : SnapshotStore
+        Optional store of search results for incremental refresh.
+    compress : bool
+        Keep descriptions of collected `Vacancy` records compressed
+        until they are added to columns.
 
     """
     __API_BASE_URL = "https://api.hh.ru/vacancies/"
-    __DICT_KEYS = (
-        "Ids",
-        "Employer",
-        "Name",
-        "Salary",
-        "From",
-        "To",
-        "Experience",
-        "Schedule",
-        "Keys",
-        "Description",
-    )
+    # hh.ru returns at most 2000 vacancies for one search
+    __MAX_IDS = 1999
+    __DEFAULT_PER_PAGE = 20
+    __DATE_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
+    __DICT_KEYS = COLUMNS
+    # Cleaned description and its words, kept in cached documents
+    __TEXT_KEY = "_text"
+    __TOKENS_KEY = "_tokens"
 
-    def __init__(self, exchange_rates: Optional[Dict]):
-        self._rates = exchange_rates
+    def __init__(self, cache: Optional[VacancyCache] = None,
+                 api_url: Optional[str] = None, snapshots: Optional[SnapshotStore] = None,
+                 compress: bool = False):
+        self._cache = cache
+        self._compress = compress
+        self._api_url = api_url or self.__API_BASE_URL
+        self._snapshots = snapshots
 
     @staticmethod
     def clean_tags(html_text: str) -> str:
@@ -60,58 +96,273 @@ class Collector:
             Clean text without HTML tags
 
         """
-        pattern = re.compile("<.*?>")
-        return re.sub(pattern, "", html_text)
+        return clean_tags(html_text)
+
+    def describe(self, vacancy: Dict) -> Tuple[str, List[str]]:
+        """Cleaned description and its words, computed once per document.
+
+        Results are saved into the document, so a cached vacancy is not
+        cleaned and tokenized again.
+
+        """
+        if self.__TOKENS_KEY not in vacancy:
+            text = clean_tags(vacancy["description"])
+            vacancy[self.__TEXT_KEY] = text
+            vacancy[self.__TOKENS_KEY] = tokenize(text, get_stop_words())
+        return vacancy[self.__TEXT_KEY], vacancy[self.__TOKENS_KEY]
+
+    def fetch_vacancy(self, vacancy_id: str, refresh: bool = False) -> Dict:
+        """Get vacancy JSON from the cache or from hh.ru
+
+        Parameters
+        ----------
+        vacancy_id : str
+            Vacancy id.
+        refresh : bool
+            Ignore cached document and download it again.
+
+        """
+        vacancy = self._cached(vacancy_id, refresh)
+        if vacancy is not None:
+            return vacancy
+
+        vacancy = get_json(f"{self._api_url}{vacancy_id}")
+        self._store(vacancy_id, vacancy)
+        return vacancy
+
+    def _cached(self, vacancy_id: str, refresh: bool) -> Optional[Dict]:
+        if self._cache is None or refresh:
+            return None
+        return self._cache.get(vacancy_id)
+
+    def _store(self, vacancy_id: str, vacancy: Dict):
+        # Do not cache error documents (e.g. {"errors": [...]})
+        if self._cache is not None and "id" in vacancy:
+            if "description" in vacancy:
+                self.describe(vacancy)
+            self._cache.put(vacancy_id, vacancy)
+
+    def get_vacancy(self, vacancy_id: str, refresh: bool = False):
+        try:
+            vacancy = self.fetch_vacancy(vacancy_id, refresh=refresh)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.warning(f"[WARN]: Cannot get vacancy {vacancy_id}: {e}")
+            return None
+        return self.parse_vacancy(vacancy_id, vacancy)
 
     @staticmethod
-    def convert_gross_to_net(is_gross: bool) -> float:
-        return 0.87 if is_gross else 1
-
-    def get_vacancy(self, vacancy_id: str):
-        # Get data from URL
-        url = f"{self.__API_BASE_URL}{vacancy_id}"
-        vacancy = requests.api.get(url).json()
-        salary = None
+    def raw_salary(salary: Optional[Dict]) -> Tuple:
+        """Salary values in order of From, To, Currency, Gross."""
+        if not salary:
+            return None, None, None, False
+        return salary.get("from"), salary.get("to"), salary.get("currency"), bool(salary.get("gross"))
+
+    def parse_vacancy(self, vacancy_id: str, vacancy: Dict) -> Optional[Vacancy]:
+        """Get useful values from vacancy JSON.
+
+        Returns
+        -------
+        Vacancy
+            Parsed vacancy or None for broken one.
+
+        """
         result = None
-        # Extract salary
         try:
             salary = vacancy["salary"]
+            description, tokens = self.describe(vacancy)
 
-            # Calculate salary:
-            # Get salary into {RUB, USD, EUR} with {Gross} parameter and
-            # return a new salary in RUB.
-            from_to = {"from": None, "to": None}
-            if salary:
-                is_gross = vacancy["salary"]["gross"]
-                for k, v in from_to.items():
-                    if vacancy["salary"][k] is not None:
-                        try:
-                            _value = self.convert_gross_to_net(is_gross)
-                            from_to[k] = int(_value * salary[k] /
-                                             self._rates[salary["currency"]])
-                        except Exception:
-                            #logger.info("[EXCEPTION] Unknown currency")
-                            #print("[EXCEPTION] Unknown currency")
-                            pass
-
-        # Create pages tuple
-            result = (
+            result = Vacancy(
                 vacancy_id,
                 vacancy["employer"]["name"],
                 vacancy["name"],
                 salary is not None,
-                from_to["from"],
-                from_to["to"],
+                *self.raw_salary(salary),
                 vacancy["experience"]["name"],
                 vacancy["schedule"]["name"],
                 [el["name"] for el in vacancy["key_skills"]],
-                self.clean_tags(vacancy["description"]),
+                description,
+                tokens,
+                compress=self._compress,
             )
         except Exception:
-            pass
+            METRICS.inc("parse_errors")
+            logger.warning(f"[WARN]: Cannot parse vacancy {vacancy_id}")
         return result
 
-    def collect_vacancies(self, query: Optional[Dict], refresh: bool = False, max_workers: int = 1) -> Dict:
+    def parse_item(self, item: Dict) -> Optional[Vacancy]:
+        """Get useful values from a search item, without detail request.
+
+        Search items have no key skills and description: Keys is empty,
+        Description is the short snippet of requirements and responsibilities.
+
+        Returns
+        -------
+        Vacancy
+            Parsed vacancy or None for broken item.
+
+        """
+        result = None
+        try:
+            salary = item.get("salary")
+            snippet = item.get("snippet") or {}
+            description = self.clean_tags(
+                " ".join(filter(None, [snippet.get("requirement"), snippet.get("responsibility")])))
+            result = Vacancy(
+                item["id"],
+                item["employer"]["name"],
+                item["name"],
+                salary is not None,
+                *self.raw_salary(salary),
+                (item.get("experience") or {}).get("name"),
+                (item.get("schedule") or {}).get("name"),
+                [],
+                description,
+                tokenize(description, get_stop_words()),
+                compress=self._compress,
+            )
+        except Exception:
+            METRICS.inc("parse_errors")
+            logger.warning(f"[WARN]: Cannot parse search item {item.get('id')}")
+        return result
+
+    def _pages_to_fetch(self, query: Dict, first_page: Dict) -> int:
+        """Number of search pages needed to get `__MAX_IDS` vacancies."""
+        per_page = int(query.get("per_page", self.__DEFAULT_PER_PAGE))
+        return min(first_page.get("pages", 0), math.ceil(self.__MAX_IDS / per_page))
+
+    def _iter_pages(self, query: Dict, max_workers: int = 1) -> Iterator[List[Dict]]:
+        """Yield items of search pages in order as soon as each page arrives.
+
+        The first page tells the number of pages, the rest of pages are
+        fetched concurrently. Stops at broken page or at `__MAX_IDS` items.
+
+        """
+        target_url = self._api_url + "?" + urlencode(query)
+        first_page = get_json(target_url, {"page": 0})
+        num_pages = self._pages_to_fetch(query, first_page)
+
+        count = 0
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, num_pages - 1))) as executor:
+            rest = executor.map(lambda idx: get_json(target_url, {"page": idx}), range(1, num_pages))
+            for data in itertools.chain([first_page], rest):
+                if count >= self.__MAX_IDS or "items" not in data:
+                    break
+                count += len(data["items"])
+                yield data["items"]
+
+    def collect_items(self, query: Optional[Dict], max_workers: int = 1) -> List[Dict]:
+        """Get search results: short vacancy items from all pages.
+
+        Parameters
+        ----------
+        query : dict
+            Search query params for GET requests.
+        max_workers :  int
+            Number of workers for threading.
+
+        Returns
+        -------
+        list
+            Search items in the order of pages.
+
+        """
+        return [item for items in self._iter_pages(query, max_workers) for item in items]
+
+    def iter_vacancies(self, query: Optional[Dict], refresh: bool = False, max_workers: int = 1,
+                       queue_size: int = 200) -> Iterator[Tuple[int, Vacancy]]:
+        """Stream vacancies: details are fetched while search pages are listed.
+
+        One thread lists search pages and puts vacancy ids into a bounded
+        queue, `max_workers` threads take ids from it and fetch details.
+
+        Parameters
+        ----------
+        query : dict
+            Search query params for GET requests.
+        refresh :  bool
+            Refresh cached data: download every vacancy even if it is cached.
+        max_workers :  int
+            Number of workers for threading.
+        queue_size : int
+            Maximum number of ids and results waiting between stages.
+
+        Yields
+        ------
+        tuple
+            (position, vacancy) in order of completion, position is the
+            index of vacancy in search results.
+
+        """
+        ids_queue = queue.Queue(maxsize=queue_size)
+        results = queue.Queue(maxsize=queue_size)
+        stop = threading.Event()
+        errors = []
+
+        def put(q: queue.Queue, value) -> bool:
+            while not stop.is_set():
+                try:
+                    q.put(value, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def get(q: queue.Queue):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            return _DONE
+
+        def produce():
+            try:
+                position = 0
+                for items in self._iter_pages(query, max_workers):
+                    for item in items:
+                        if not put(ids_queue, (position, item["id"])):
+                            return
+                        position += 1
+            except Exception as e:
+                errors.append(e)
+            finally:
+                for _ in range(max_workers):
+                    put(ids_queue, _DONE)
+
+        def consume():
+            try:
+                while True:
+                    task = get(ids_queue)
+                    if task is _DONE:
+                        break
+                    position, vacancy_id = task
+                    vacancy = self.get_vacancy(vacancy_id, refresh=refresh)
+                    if vacancy is not None and not put(results, (position, vacancy)):
+                        break
+            finally:
+                put(results, _DONE)
+
+        threads = [threading.Thread(target=produce, daemon=True)]
+        threads.extend(threading.Thread(target=consume, daemon=True) for _ in range(max_workers))
+        for thread in threads:
+            thread.start()
+        try:
+            finished = 0
+            while finished < max_workers:
+                result = results.get()
+                if result is _DONE:
+                    finished += 1
+                else:
+                    yield result
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+
+    def collect_vacancies(self, query: Optional[Dict], refresh: bool = False, max_workers: int = 1,
+                          queue_size: int = 200, on_vacancy: VacancyCallback = None) -> Optional[VacancyColumns]:
         """Parse vacancy JSON: get vacancy name, salary, experience etc.
 
         Parameters
@@ -119,71 +370,408 @@ class Collector:
         query : dict
             Search query params for GET requests.
         refresh :  bool
-            Refresh cached data
+            Refresh cached data: download every vacancy even if it is cached.
+        max_workers :  int
+            Number of workers for threading.
+        queue_size : int
+            Size of the queue between listing and detail fetching.
+        on_vacancy : callable
+            Called with every collected `Vacancy`.
+
+        Returns
+        -------
+        VacancyColumns
+            Columns of useful arguments from vacancies
+
+        """
+        columns = VacancyColumns(self.__DICT_KEYS)
+        for position, vacancy in tqdm(
+            self.iter_vacancies(query, refresh=refresh, max_workers=max_workers, queue_size=queue_size),
+            desc="Get data via HH API", ncols=100,
+        ):
+            # Rows are sorted back into the order of search results by position
+            columns.append(vacancy.as_row(), position)
+            if on_vacancy is not None:
+                on_vacancy(vacancy)
+        return columns if columns.size else None
+
+    def collect_listing(self, query: Optional[Dict], max_workers: int = 1,
+                        on_vacancy: VacancyCallback = None, snapshot: bool = False) -> Optional[VacancyColumns]:
+        """Fast version of `collect_vacancies`: use search items only
+
+        About 40 search requests instead of ~2000 detail requests. Salary,
+        employer, name and schedule are the same, but Keys are empty and
+        Description is a short snippet. Use `fill_details` to get them.
+
+        Parameters
+        ----------
+        query : dict
+            Search query params for GET requests.
         max_workers :  int
             Number of workers for threading.
+        on_vacancy : callable
+            Called with every collected `Vacancy`.
+        snapshot : bool
+            Save listed ids as a snapshot for `collect_vacancies_incremental`.
 
         Returns
         -------
-        dict
-            Dict of useful arguments from vacancies
+        VacancyColumns
+            Columns of useful arguments from vacancies
 
         """
+        started_at = datetime.now(timezone.utc)
+        items = self.collect_items(query, max_workers=max_workers)
+        if snapshot and self._snapshots is not None:
+            self._save_snapshot(query, {x["id"]: x.get("published_at", "") for x in items}, started_at)
+        return self._to_columns((self.parse_item(item) for item in items), on_vacancy)
+
+    def fill_details(self, vacancies: Dict, refresh: bool = False, max_workers: int = 1,
+                     on_vacancy: VacancyCallback = None) -> Optional[VacancyColumns]:
+        """Fetch vacancy details for vacancies from `collect_listing`.
+
+        Returns
+        -------
+        VacancyColumns
+            Columns of useful arguments from vacancies, vacancies which details
+            cannot be fetched are dropped.
+
         """
-        # Get cached data if exists...
-        cache_name: str = query.get("text")
-        cache_hash = hashlib.md5(cache_name.encode()).hexdigest()
-        cache_file = os.path.join(CACHE_DIR, cache_hash)
+        get_vacancy = partial(self.get_vacancy, refresh=refresh)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return self._to_columns(tqdm(
+                executor.map(get_vacancy, vacancies["Ids"]),
+                desc="Get details via HH API", ncols=100, total=len(vacancies["Ids"]),
+            ), on_vacancy)
+
+    def collect_many(self, queries: List[Dict], refresh: bool = False, max_workers: int = 1,
+                     on_vacancy: VacancyCallback = None) -> List[Optional[VacancyColumns]]:
+        """Collect vacancies of several searches, each vacancy is fetched once
+
+        Searches are listed concurrently, then details are fetched for the
+        union of their ids: overlapping searches cost one detail request per
+        distinct vacancy.
+
+        Parameters
+        ----------
+        queries : list
+            Search query params for GET requests.
+        refresh : bool
+            Refresh cached data.
+        max_workers :  int
+            Number of workers for threading.
+        on_vacancy : callable
+            Called with every distinct collected `Vacancy`.
+
+        Returns
+        -------
+        list
+            VacancyColumns (or None if nothing is found) for every query,
+            rows in order of search results.
+
+        """
+        with ThreadPoolExecutor(max_workers=max(1, len(queries))) as executor:
+            listings = list(executor.map(
+                lambda query: [item["id"] for item in self.collect_items(query, max_workers=max_workers)], queries))
+
+        unique_ids = list(dict.fromkeys(itertools.chain.from_iterable(listings)))
+        logger.info(f"[INFO]: {sum(map(len, listings))} vacancies listed, {len(unique_ids)} distinct")
+
+        rows = {}
+        get_vacancy = partial(self.get_vacancy, refresh=refresh)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for vacancy_id, row in zip(unique_ids, tqdm(
+                executor.map(get_vacancy, unique_ids),
+                desc="Get data via HH API", ncols=100, total=len(unique_ids),
+            )):
+                rows[vacancy_id] = row
+                if row is not None and on_vacancy is not None:
+                    on_vacancy(row)
+        return [self._to_columns(rows[vacancy_id] for vacancy_id in ids) for ids in listings]
+
+    def _get_current_vacancy(self, task: Tuple[str, bool]) -> Optional[Dict]:
+        """Vacancy JSON for an (id, refresh) task or None if it is gone."""
+        vacancy_id, refresh = task
         try:
-            if not refresh:
-                print(
-                    f"[INFO]: Get results from cache! Enable refresh option to update results.")
-                return pickle.load(open(cache_file, "rb"))
-        except (FileNotFoundError, pickle.UnpicklingError):
-            pass
+            vacancy = self.fetch_vacancy(vacancy_id, refresh=refresh)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.warning(f"[WARN]: Cannot get vacancy {vacancy_id}: {e}")
+            return None
+        if "id" not in vacancy or vacancy.get("archived"):
+            return None
+        return vacancy
+
+    def collect_vacancies_incremental(self, query: Optional[Dict], max_workers: int = 1, max_age_days: int = 30,
+                                      on_vacancy: VacancyCallback = None) -> Optional[VacancyColumns]:
+        """Update the last snapshot of the query instead of a full crawl
+
+        Only vacancies published since the previous call are listed and
+        downloaded. Other vacancies of the snapshot come from the vacancy
+        cache. Archived vacancies and vacancies older than `max_age_days`
+        are dropped. The first call for a query is a full crawl.
+
+        Parameters
+        ----------
+        query : dict
+            Search query params for GET requests.
+        max_workers :  int
+            Number of workers for threading.
+        max_age_days : int
+            hh.ru publishes a vacancy for 30 days, older ids are expired.
+        on_vacancy : callable
+            Called with every collected `Vacancy`.
+
+        Returns
+        -------
+        VacancyColumns
+            Columns of useful arguments from vacancies
+
         """
-        # Check number of pages...
-        target_url = self.__API_BASE_URL + "?" + urlencode(query)
-        num_pages = requests.get(target_url).json()["pages"]
-
-        # Collect vacancy IDs...
-        ids = []
-        idx = 0
-        # for idx in range(num_pages + 1):
-        while(len(ids) < 1999 and idx < num_pages):
-            response = requests.get(target_url, {"page": idx})
-            data = response.json()
-            if "items" not in data:
+        if self._snapshots is None:
+            return self.collect_vacancies(query, max_workers=max_workers, on_vacancy=on_vacancy)
+
+        started_at = datetime.now(timezone.utc)
+        snapshot = self._snapshots.get(query)
+        if snapshot is None:
+            logger.info("[INFO]: No snapshot for the query, collect all vacancies")
+            known = {}
+            delta_items = self.collect_items(query, max_workers=max_workers)
+        else:
+            known = snapshot["items"]
+            delta_query = dict(query, date_from=snapshot["updated_at"])
+            delta_items = self.collect_items(delta_query, max_workers=max_workers)
+            logger.info(f"[INFO]: {len(delta_items)} new vacancies since {snapshot['updated_at']}")
+
+        # New and updated vacancies first, then still actual known ones
+        oldest = (started_at - timedelta(days=max_age_days)).strftime(self.__DATE_FORMAT)
+        items = {x["id"]: x.get("published_at", "") for x in delta_items}
+        tasks = [(vacancy_id, snapshot is not None) for vacancy_id in items]
+        for vacancy_id, published_at in known.items():
+            if len(tasks) >= self.__MAX_IDS:
                 break
-            ids.extend(x["id"] for x in data["items"])
-            idx += 1
+            if vacancy_id in items or not self._is_newer(published_at, oldest):
+                continue
+            items[vacancy_id] = published_at
+            tasks.append((vacancy_id, False))
 
-        # Collect vacancies...
-        jobs_list = []
+        columns = VacancyColumns(self.__DICT_KEYS)
+        actual = {}
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            for vacancy in tqdm(
-                executor.map(self.get_vacancy, ids), desc="Get data via HH API", ncols=100, total=len(ids),
-            ):
+            for (vacancy_id, _), vacancy in zip(tasks, tqdm(
+                executor.map(self._get_current_vacancy, tasks), desc="Get data via HH API", ncols=100,
+                total=len(tasks),
+            )):
+                if vacancy is None:
+                    continue
+                actual[vacancy_id] = vacancy.get("published_at", items[vacancy_id])
+                job = self.parse_vacancy(vacancy_id, vacancy)
+                if job is not None:
+                    columns.append(job.as_row())
+                    if on_vacancy is not None:
+                        on_vacancy(job)
+
+        self._save_snapshot(query, actual, started_at)
+        return columns if columns.size else None
+
+    def has_snapshot(self, query: Dict) -> bool:
+        """True if `collect_vacancies_incremental` can update a snapshot of the query."""
+        return self._snapshots is not None and self._snapshots.get(query) is not None
+
+    def _save_snapshot(self, query: Dict, items: Dict[str, str], started_at: datetime):
+        # Overlap a bit with the previous snapshot: hh.ru indexes with a delay
+        updated_at = (started_at - timedelta(minutes=10)).strftime(self.__DATE_FORMAT)
+        self._snapshots.put(query, {"updated_at": updated_at, "items": items})
+
+    def _is_newer(self, published_at: str, oldest: str) -> bool:
+        try:
+            return datetime.strptime(published_at, self.__DATE_FORMAT) >= datetime.strptime(oldest, self.__DATE_FORMAT)
+        except (TypeError, ValueError):
+            # Unknown date: keep the vacancy, it is checked for "archived" anyway
+            return True
+
+    def _to_columns(self, jobs_list: Iterable[Optional[Vacancy]],
+                    on_vacancy: VacancyCallback = None) -> Optional[VacancyColumns]:
+        """Columns of vacancies, broken (None) vacancies are skipped."""
+        columns = VacancyColumns(self.__DICT_KEYS)
+        for job in jobs_list:
+            if job is not None:
+                columns.append(job.as_row())
+                if on_vacancy is not None:
+                    on_vacancy(job)
+        return columns if columns.size else None
+
+    async def _fetch_json_async(self, client: AsyncHTTPClient, url: str) -> Dict:
+        retries, backoff_factor = retry_settings()
+        STATS.count("requests")
+        attempt = 0
+        while True:
+            try:
+                response = await client.fetch(url)
+                return json.loads(response.body)
+            except HTTPClientError as e:
+                if e.code not in ASYNC_RETRY_STATUSES or attempt >= retries:
+                    STATS.count("errors")
+                    raise
+                retry_after = e.response.headers.get("Retry-After") if e.response is not None else None
+            except OSError:
+                if attempt >= retries:
+                    STATS.count("errors")
+                    raise
+                retry_after = None
+            attempt += 1
+            STATS.count("retries")
+            await asyncio.sleep(backoff_delay(attempt, backoff_factor, retry_after))
+
+    async def _get_vacancy_async(self, client: AsyncHTTPClient, vacancy_id: str, refresh: bool):
+        # Cache files, fsync and tokenization would block the event loop
+        loop = asyncio.get_running_loop()
+        vacancy = await loop.run_in_executor(None, self._cached, vacancy_id, refresh)
+        if vacancy is None:
+            try:
+                vacancy = await self._fetch_json_async(client, f"{self._api_url}{vacancy_id}")
+            except (HTTPClientError, OSError, ValueError) as e:
+                logger.warning(f"[WARN]: Cannot get vacancy {vacancy_id}: {e}")
+                return None
+            await loop.run_in_executor(None, self._store, vacancy_id, vacancy)
+        return await loop.run_in_executor(None, self.parse_vacancy, vacancy_id, vacancy)
+
+    async def _iter_pages_async(self, client: AsyncHTTPClient, query: Dict) -> AsyncIterator[List[Dict]]:
+        """Asyncio version of `_iter_pages`."""
+        target_url = self._api_url + "?" + urlencode(query)
+        first_page = await self._fetch_json_async(client, f"{target_url}&page=0")
+        num_pages = self._pages_to_fetch(query, first_page)
+
+        rest = [asyncio.ensure_future(self._fetch_json_async(client, f"{target_url}&page={idx}"))
+                for idx in range(1, num_pages)]
+        try:
+            count = 0
+            for idx in range(max(num_pages, 1)):
+                data = first_page if idx == 0 else await rest[idx - 1]
+                if count >= self.__MAX_IDS or "items" not in data:
+                    break
+                count += len(data["items"])
+                yield data["items"]
+        finally:
+            for task in rest:
+                task.cancel()
+
+    async def collect_items_async(self, client: AsyncHTTPClient, query: Optional[Dict]) -> List[Dict]:
+        """Asyncio version of `collect_items`."""
+        return [item async for items in self._iter_pages_async(client, query) for item in items]
+
+    async def collect_vacancies_async(self, query: Optional[Dict], refresh: bool = False,
+                                      max_concurrency: int = 100, queue_size: int = 200,
+                                      on_vacancy: VacancyCallback = None) -> Optional[VacancyColumns]:
+        """Asyncio version of `collect_vacancies`
+
+        All requests run on one thread. Details are fetched by
+        `max_concurrency` worker coroutines while search pages are still
+        being listed. tornado's simple client does not reuse connections,
+        so every request opens a new one, unlike the shared session of the
+        thread engine.
+
+        Parameters
+        ----------
+        query : dict
+            Search query params for GET requests.
+        refresh :  bool
+            Refresh cached data: download every vacancy even if it is cached.
+        max_concurrency :  int
+            Maximum number of simultaneous HTTP requests.
+        queue_size : int
+            Size of the queue between listing and detail fetching.
+        on_vacancy : callable
+            Called with every collected `Vacancy`.
+
+        Returns
+        -------
+        VacancyColumns
+            Columns of useful arguments from vacancies, same as `collect_vacancies`
+
+        """
+        client = AsyncHTTPClient(force_instance=True, max_clients=max_concurrency)
+
+        async def iter_ids():
+            async for items in self._iter_pages_async(client, query):
+                for item in items:
+                    yield item["id"]
+
+        try:
+            return await self._fetch_details_async(client, iter_ids(), refresh, max_concurrency, queue_size, on_vacancy)
+        finally:
+            client.close()
+
+    async def fill_details_async(self, vacancies: Dict, refresh: bool = False, max_concurrency: int = 100,
+                                 queue_size: int = 200, on_vacancy: VacancyCallback = None) -> Optional[VacancyColumns]:
+        """Asyncio version of `fill_details`."""
+        client = AsyncHTTPClient(force_instance=True, max_clients=max_concurrency)
+
+        async def iter_ids():
+            for vacancy_id in vacancies["Ids"]:
+                yield vacancy_id
+
+        try:
+            return await self._fetch_details_async(client, iter_ids(), refresh, max_concurrency, queue_size, on_vacancy)
+        finally:
+            client.close()
+
+    async def _fetch_details_async(self, client: AsyncHTTPClient, ids: AsyncIterator[str], refresh: bool,
+                                   max_concurrency: int, queue_size: int,
+                                   on_vacancy: VacancyCallback) -> Optional[VacancyColumns]:
+        """Fetch details of `ids` by `max_concurrency` worker coroutines.
+
+        Rows are sorted by position of ids. The first error of `ids` or of a
+        worker (e.g. of `on_vacancy`) cancels the others and is raised.
+
+        """
+        ids_queue = asyncio.Queue(maxsize=queue_size)
+        columns = VacancyColumns(self.__DICT_KEYS)
+        progress = tqdm(desc="Get data via HH API", ncols=100)
+        loop = asyncio.get_running_loop()
+        # on_vacancy may block (e.g. send a message), it is called in order on its own thread
+        callbacks = ThreadPoolExecutor(max_workers=1, thread_name_prefix="on_vacancy")
+
+        async def produce():
+            position = 0
+            async for vacancy_id in ids:
+                await ids_queue.put((position, vacancy_id))
+                position += 1
+            for _ in range(max_concurrency):
+                await ids_queue.put(_DONE)
+
+        async def consume():
+            while True:
+                task = await ids_queue.get()
+                if task is _DONE:
+                    return
+                position, vacancy_id = task
+                vacancy = await self._get_vacancy_async(client, vacancy_id, refresh)
+                progress.update()
                 if vacancy is not None:
-                    jobs_list.append(vacancy)
+                    columns.append(vacancy.as_row(), position)
+                    if on_vacancy is not None:
+                        await loop.run_in_executor(callbacks, on_vacancy, vacancy)
 
-        unzipped_list = list(zip(*jobs_list))
-       
-        if len(jobs_list) == 0:
-            result = None
-        else:
-            result = {}
-            for idx, key in enumerate(self.__DICT_KEYS):
-                result[key] = unzipped_list[idx]
+        # Workers blocked on the bounded queue are only released by cancellation
+        tasks = [asyncio.ensure_future(produce())] + [asyncio.ensure_future(consume()) for _ in range(max_concurrency)]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in tasks:
+                if task.done() and not task.cancelled() and task.exception() is not None:
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            callbacks.shutdown(wait=False)
+            progress.close()
 
-        #pickle.dump(result, open(cache_file, "wb"))
-        return result
+        return columns if columns.size else None
 
 
 """
 if __name__ == "__main__":
-    dc = Collector(exchange_rates={"USD": 0.01264,
-                   "EUR": 0.01083, "RUR": 1.00000})
+    dc = Collector()
 
     vacancies = dc.collect_vacancies(
         query={"text": "FPGA", "area": 1, "per_page": 50},
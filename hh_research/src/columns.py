@@ -0,0 +1,124 @@
+r"""Columnar storage of collected vacancies
+
+Vacancies are appended into typed buffers instead of a list of tuples:
+salaries go to float arrays, repeated strings (experience, schedule,
+employer) to categorical codes. Columns are read-only numpy views of
+the buffers, and numpy cannot resize a buffer while its views exist, so
+columns are frozen on the first read. `to_frame` copies the views, a
+frame can be edited without changing the collected data.
+------------------------------------------------------------------------
+"""
+
+import sys
+from array import array
+from collections.abc import Mapping
+from typing import Dict, Iterator, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+class VacancyColumns(Mapping):
+    r"""Mapping {column name: column} filled row by row
+
+    Parameters
+    ----------
+    keys : tuple
+        Column names in the order of values in appended rows.
+
+    """
+    NUMERIC = ("From", "To")
+    FLAGS = ("Salary", "Gross")
+    CATEGORICAL = ("Currency", "Experience", "Schedule", "Employer")
+    INTERNED = ("Ids", "Name")
+
+    def __init__(self, keys: Sequence[str]):
+        self._keys = tuple(keys)
+        self._numeric = {k: array("d") for k in self._keys if k in self.NUMERIC}
+        self._flags = {k: array("B") for k in self._keys if k in self.FLAGS}
+        self._codes = {k: array("i") for k in self._keys if k in self.CATEGORICAL}
+        self._categories: Dict[str, Dict[str, int]] = {k: {} for k in self._codes}
+        self._objects = {k: [] for k in self._keys
+                         if k not in self._numeric and k not in self._flags and k not in self._codes}
+        self._positions = array("q")
+        self._ordered = True
+        self._frozen = False
+
+    def append(self, row: tuple, position: Optional[int] = None):
+        """Append one vacancy.
+
+        Parameters
+        ----------
+        row : tuple
+            Values in order of `keys`.
+        position : int
+            Index of vacancy in search results, rows are sorted by it in
+            `to_frame`. Default is the order of appending.
+
+        Raises
+        ------
+        RuntimeError
+            If columns were already read.
+
+        """
+        if self._frozen:
+            raise RuntimeError("VacancyColumns are read-only after the first read of a column")
+        if position is None:
+            position = len(self._positions)
+        if self._positions and position < self._positions[-1]:
+            self._ordered = False
+        self._positions.append(position)
+
+        for key, value in zip(self._keys, row):
+            if key in self._numeric:
+                self._numeric[key].append(np.nan if value is None else value)
+            elif key in self._flags:
+                self._flags[key].append(bool(value))
+            elif key in self._codes:
+                if value is None:
+                    self._codes[key].append(-1)
+                else:
+                    codes = self._categories[key]
+                    self._codes[key].append(codes.setdefault(value, len(codes)))
+            elif key in self.INTERNED and isinstance(value, str):
+                self._objects[key].append(sys.intern(value))
+            elif key in ("Keys", "Tokens"):
+                self._objects[key].append([sys.intern(el) for el in value])
+            else:
+                self._objects[key].append(value)
+
+    @property
+    def size(self) -> int:
+        """Number of vacancies."""
+        return len(self._positions)
+
+    def __getitem__(self, key: str):
+        self._frozen = True
+        if key in self._numeric:
+            return self._view(self._numeric[key], np.float64)
+        if key in self._flags:
+            return self._view(self._flags[key], np.uint8).view(np.bool_)
+        if key in self._codes:
+            return pd.Categorical.from_codes(
+                self._view(self._codes[key], np.int32), categories=list(self._categories[key]))
+        return self._objects[key]
+
+    @staticmethod
+    def _view(buffer: array, dtype) -> np.ndarray:
+        view = np.frombuffer(buffer, dtype=dtype)
+        view.flags.writeable = False
+        return view
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def to_frame(self) -> pd.DataFrame:
+        """DataFrame of a copy of the columns, rows sorted by position."""
+        df = pd.DataFrame({key: self[key] for key in self._keys}, copy=True)
+        if not self._ordered:
+            order = np.argsort(np.frombuffer(self._positions, dtype=np.int64), kind="stable")
+            df = df.take(order).reset_index(drop=True)
+        return df
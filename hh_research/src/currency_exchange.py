@@ -1,19 +1,155 @@
 """Get currency exchange for RUB, EUR, USD from remore server
+
+Rates are kept in a process-wide cache, refreshed in the background and
+saved to disk, so a request never waits for the exchange rate API.
 ------------------------------------------------------------------------
 """
 import json
-from typing import Dict
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
 import logging
 import requests
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from hh_research.src.http_session import get_json
+from hh_research.src.metrics import METRICS
+
+RATES_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), "cache", "rates.json")
 
 logger = logging.getLogger(__name__)
 
+
+class _RatesCache:
+    """Last known rates of all currencies and the time they were received."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rates: Optional[Dict] = None
+        self.updated_at = 0.0
+        self.loaded = False
+        self.refreshing = False
+
+
+_cache = _RatesCache()
+
+
 class Exchanger:
     __EXCHANGE_URL = "https://api.exchangerate-api.com/v4/latest/RUB"
 
-    def __init__(self, params: Dict):
+    def __init__(self, params: Dict, rates_ttl: float = 12 * 3600, rates_path: str = RATES_PATH):
         #self.config_path = config_path
         self.params = params
+        self.rates_ttl = rates_ttl
+        self.rates_path = rates_path
+
+    def refresh_rates(self) -> bool:
+        """Download rates of all currencies into the cache and save them.
+
+        Returns
+        -------
+        bool
+            True if rates were updated.
+
+        """
+        try:
+            with METRICS.timer("rates_refresh"):
+                new_rates = get_json(self.__EXCHANGE_URL)["rates"]
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            logger.warning(f"[WARN]: Cannot get exchange rates, keep cached ones: {e}")
+            return False
+
+        with _cache.lock:
+            _cache.rates = new_rates
+            _cache.updated_at = time.time()
+            _cache.loaded = True
+        self._dump_rates(new_rates, _cache.updated_at)
+        logger.info("[INFO]: Exchange rates are updated")
+        return True
+
+    def _dump_rates(self, rates: Dict, updated_at: float):
+        try:
+            os.makedirs(os.path.dirname(self.rates_path), exist_ok=True)
+            tmp_path = self.rates_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"updated_at": updated_at, "rates": rates}, f)
+            os.replace(tmp_path, self.rates_path)
+        except OSError as e:
+            logger.warning(f"[WARN]: Cannot save exchange rates: {e}")
+
+    def _load_rates(self):
+        """Read rates saved by a previous process (cold start)."""
+        try:
+            with open(self.rates_path, "r") as f:
+                data = json.load(f)
+            _cache.rates = data["rates"]
+            _cache.updated_at = data["updated_at"]
+        except (OSError, ValueError, KeyError):
+            pass
+        _cache.loaded = True
+
+    def _refresh_in_background(self):
+        with _cache.lock:
+            if _cache.refreshing:
+                return
+            _cache.refreshing = True
+
+        def run():
+            try:
+                self.refresh_rates()
+            finally:
+                _cache.refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def get_rates(self, rates: Dict) -> Dict:
+        """Fill `rates` from the cache without network requests.
+
+        Currencies which are not cached yet keep their values, other cached
+        currencies are added, so salaries in any currency can be converted.
+        If cached rates are older than `rates_ttl`, refresh is started in
+        background.
+
+        Parameters
+        ----------
+        rates : dict
+            Dict of currencies with default values. For example: {"RUB": 1, "USD": 0.001}
+        """
+        with _cache.lock:
+            if not _cache.loaded:
+                self._load_rates()
+            cached, updated_at = _cache.rates, _cache.updated_at
+
+        if time.time() - updated_at > self.rates_ttl:
+            self._refresh_in_background()
+        if cached is None:
+            logger.warning("[WARN]: No exchange rates yet, use default ones")
+            return rates
+
+        rates.update(cached)
+        return rates
+
+    def start_background_refresh(self, scheduler: Optional[BackgroundScheduler] = None,
+                                 interval: float = 3600) -> BackgroundScheduler:
+        """Refresh rates now and then every `interval` seconds.
+
+        Parameters
+        ----------
+        scheduler : BackgroundScheduler
+            Scheduler to add the job to. A new one is created and started if None.
+        interval : float
+            Seconds between refreshes.
+
+        """
+        if scheduler is None:
+            scheduler = BackgroundScheduler(daemon=True)
+        scheduler.add_job(self.refresh_rates, "interval", seconds=interval, next_run_time=datetime.now(),
+                          id="exchange_rates", replace_existing=True, coalesce=True, max_instances=1)
+        if not scheduler.running:
+            scheduler.start()
+        return scheduler
 
     def update_exchange_rates(self, rates: Dict):
         """Parse exchange rates for RUB, USD, EUR and save them to `rates`
@@ -25,9 +161,8 @@ class Exchanger:
         """
 
         try:
-            response = requests.get(self.__EXCHANGE_URL)
-            new_rates = response.json()["rates"]
-        except requests.exceptions.SSLError:
+            new_rates = get_json(self.__EXCHANGE_URL)["rates"]
+        except (requests.exceptions.RequestException, ValueError, KeyError):
             raise AssertionError(
                 "[FAIL] Cannot get exchange rate! Try later or change the host API")
 
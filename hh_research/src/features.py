@@ -0,0 +1,120 @@
+r"""Features: stateless hashing of vacancies into sparse vectors
+
+Words of name and description are hashed into `n_text_features`
+columns, description words are taken from the Tokens column made by
+`Collector`. Key skills, experience, schedule and name are hashed as
+"field=value" tokens into `n_categorical_features` columns. Nothing is
+fitted, memory does not grow with vocabulary, and batches are split in
+chunks and transformed in parallel.
+------------------------------------------------------------------------
+"""
+
+from typing import List
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from scipy.sparse import csr_matrix, hstack, vstack
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.feature_extraction.text import HashingVectorizer
+
+from hh_research.src.text import get_stop_words, tokenize
+
+N_TEXT_FEATURES = 2 ** 18
+N_CATEGORICAL_FEATURES = 2 ** 14
+CATEGORICAL = ("Experience", "Schedule", "Name")
+
+
+def analyze_tokens(tokens: List[str]) -> List[str]:
+    """Analyzer of `HashingVectorizer` for already tokenized documents."""
+    return tokens
+
+
+def categorical_tokens(row: tuple) -> List[str]:
+    """"field=value" tokens of (keys, experience, schedule, name) row."""
+    keys, *values = row
+    tokens = [f"{field}={value}" for field, value in zip(CATEGORICAL, values) if isinstance(value, str)]
+    if isinstance(keys, list):
+        tokens += [f"Keys={key.lower()}" for key in keys]
+    return tokens
+
+
+class HashingFeaturizer:
+    r"""Vacancies to sparse feature matrix without fitting
+
+    Parameters
+    ----------
+    n_text_features : int
+        Number of hashed word columns.
+    n_categorical_features : int
+        Number of hashed columns for key skills and categorical fields.
+    n_jobs : int
+        Number of parallel processes, -1 for all cores.
+    chunk_size : int
+        Vacancies per parallel task. Smaller batches are transformed in
+        the calling process.
+
+    """
+
+    def __init__(self, n_text_features: int = N_TEXT_FEATURES,
+                 n_categorical_features: int = N_CATEGORICAL_FEATURES,
+                 n_jobs: int = -1, chunk_size: int = 500):
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+        self.text_hasher = HashingVectorizer(
+            n_features=n_text_features, analyzer=analyze_tokens, alternate_sign=False, norm="l2")
+        self.categorical_hasher = FeatureHasher(
+            n_features=n_categorical_features, input_type="string", alternate_sign=False)
+
+    @property
+    def n_features(self) -> int:
+        return self.text_hasher.n_features + self.categorical_hasher.n_features
+
+    @staticmethod
+    def texts(df: pd.DataFrame) -> List[List[str]]:
+        """Words of name and description of every vacancy.
+
+        Descriptions are tokenized here only if there is no Tokens column.
+        """
+        stop_words = get_stop_words()
+        names = df["Name"].fillna("").astype(str)
+        if "Tokens" in df:
+            return [tokenize(name, stop_words) + tokens for name, tokens in zip(names, df["Tokens"])]
+        descriptions = df["Description"].fillna("").astype(str)
+        return [tokenize(f"{name} {text}", stop_words) for name, text in zip(names, descriptions)]
+
+    @staticmethod
+    def rows(df: pd.DataFrame) -> List[tuple]:
+        columns = [df["Keys"]] + [df[field].astype(object) for field in CATEGORICAL]
+        return list(zip(*columns))
+
+    def _transform_chunk(self, texts: List[List[str]], rows: List[tuple]) -> csr_matrix:
+        return hstack([
+            self.text_hasher.transform(texts),
+            self.categorical_hasher.transform(categorical_tokens(row) for row in rows),
+        ], format="csr", dtype=np.float64)
+
+    def transform(self, df: pd.DataFrame) -> csr_matrix:
+        """Feature matrix of vacancies, one row per vacancy in order of `df`.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            Vacancies with Name, Tokens (or Description), Keys, Experience
+            and Schedule.
+
+        Returns
+        -------
+        csr_matrix
+            Matrix of shape (len(df), `n_features`).
+
+        """
+        texts, rows = self.texts(df), self.rows(df)
+        if len(texts) <= self.chunk_size or self.n_jobs == 1:
+            return self._transform_chunk(texts, rows)
+        bounds = range(0, len(texts), self.chunk_size)
+        chunks = Parallel(n_jobs=self.n_jobs)(
+            delayed(self._transform_chunk)(texts[i:i + self.chunk_size], rows[i:i + self.chunk_size])
+            for i in bounds
+        )
+        return vstack(chunks, format="csr")
@@ -0,0 +1,140 @@
+r"""Shared HTTP session for hh.ru and exchange rate API
+
+One `requests.Session` per process keeps connections alive between
+calls. Requests that fail with 429 or 5xx are retried with exponential
+backoff, `Retry-After` header is respected.
+------------------------------------------------------------------------
+"""
+
+import random
+import threading
+from collections import Counter
+from typing import Dict, Optional
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+DEFAULT_TIMEOUT = 15
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+
+
+class RequestStats:
+    """Thread-safe counters of HTTP requests, errors and retries."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = Counter()
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def as_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+
+STATS = RequestStats()
+
+
+class CountingRetry(Retry):
+    """urllib3 Retry which counts every retry attempt in `STATS`."""
+
+    def increment(self, *args, **kwargs):
+        new_retry = super().increment(*args, **kwargs)
+        STATS.count("retries")
+        return new_retry
+
+
+_session: Optional[requests.Session] = None
+_session_params: Optional[tuple] = None
+_session_lock = threading.Lock()
+
+
+def configure_session(pool_size: int = 10, retries: int = DEFAULT_RETRIES,
+                      backoff_factor: float = DEFAULT_BACKOFF) -> requests.Session:
+    """Create shared session or change its settings.
+
+    Parameters
+    ----------
+    pool_size : int
+        Number of keep-alive connections per host.
+    retries : int
+        Number of retries for failed requests.
+    backoff_factor : float
+        Delay before the n-th retry is `backoff_factor * 2 ** (n - 1)` seconds.
+
+    """
+    global _session, _session_params
+    params = (pool_size, retries, backoff_factor)
+    with _session_lock:
+        if _session is not None and _session_params == params:
+            return _session
+        if _session is None:
+            _session = requests.Session()
+        retry = CountingRetry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(["GET"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+        _session_params = params
+        return _session
+
+
+def get_session() -> requests.Session:
+    """Return shared session, create it with default settings if needed."""
+    if _session is None:
+        return configure_session()
+    return _session
+
+
+def retry_settings() -> tuple:
+    """Current (retries, backoff_factor) pair, for clients outside `requests`."""
+    if _session_params is None:
+        return DEFAULT_RETRIES, DEFAULT_BACKOFF
+    return _session_params[1], _session_params[2]
+
+
+def get_json(url: str, params: Optional[Dict] = None, timeout: float = DEFAULT_TIMEOUT) -> Dict:
+    """GET `url` with the shared session and decode JSON response.
+
+    Raises
+    ------
+    requests.exceptions.RequestException
+        If the request still fails after all retries.
+
+    """
+    STATS.count("requests")
+    try:
+        response = get_session().get(url, params=params, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+    except (requests.exceptions.RequestException, ValueError):
+        STATS.count("errors")
+        raise
+
+
+def backoff_delay(attempt: int, backoff_factor: float = DEFAULT_BACKOFF, retry_after: Optional[str] = None) -> float:
+    """Delay in seconds before retry number `attempt` (starting from 1).
+
+    `Retry-After` header value in seconds takes precedence over backoff.
+
+    """
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+    return backoff_factor * 2 ** (attempt - 1) + random.uniform(0, backoff_factor)
@@ -0,0 +1,146 @@
+r"""Metrics: stage timers and counters in Prometheus text format
+
+Researcher pipeline stages (exchange rates, listing, detail fetches,
+prepare_df, analyze_df, plotting) are timed with `METRICS.timer`. HTTP
+counters come from `http_session.STATS`, vacancies which cannot be
+parsed are counted as parse_errors, caches register their hit/miss
+counters as callbacks. `serve_metrics` exposes everything on /metrics.
+------------------------------------------------------------------------
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Tuple
+import logging
+
+from hh_research.src.http_session import STATS
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "hh"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Metrics:
+    """Thread-safe registry of counters, gauges and stage timers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, float] = {}
+        # stage: [count, total seconds, last seconds]
+        self._stages: Dict[str, List[float]] = {}
+        self._callbacks: Dict[str, Tuple[str, str, Callable[[], float]]] = {}
+
+    def inc(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set(self, name: str, value: float):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            stat = self._stages.setdefault(stage, [0, 0.0, 0.0])
+            stat[0] += 1
+            stat[1] += seconds
+            stat[2] = seconds
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """Measure wall time of the block as `stage`, also if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def register(self, name: str, callback: Callable[[], float], help: str = "", kind: str = "gauge"):
+        """Read value of metric `name` from `callback` on every render.
+
+        Parameters
+        ----------
+        kind : str
+            Prometheus type: "gauge" or "counter".
+
+        """
+        with self._lock:
+            self._callbacks[name] = (kind, help, callback)
+
+    def render(self) -> str:
+        """All metrics in Prometheus text exposition format."""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            stages = {k: list(v) for k, v in self._stages.items()}
+            callbacks = dict(self._callbacks)
+
+        lines = []
+        if stages:
+            lines += [f"# HELP {PREFIX}_stage_seconds Time spent in Researcher pipeline stages",
+                      f"# TYPE {PREFIX}_stage_seconds summary"]
+            for stage, (count, total, _) in sorted(stages.items()):
+                lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+                lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {count:d}')
+            lines += [f"# HELP {PREFIX}_stage_last_seconds Duration of the last run of a stage",
+                      f"# TYPE {PREFIX}_stage_last_seconds gauge"]
+            for stage, (_, _, last) in sorted(stages.items()):
+                lines.append(f'{PREFIX}_stage_last_seconds{{stage="{stage}"}} {last:.6f}')
+
+        lines += [f"# HELP {PREFIX}_http_events_total HTTP requests, errors and retries",
+                  f"# TYPE {PREFIX}_http_events_total counter"]
+        for event, value in sorted(STATS.as_dict().items()):
+            lines.append(f'{PREFIX}_http_events_total{{event="{event}"}} {value}')
+
+        for name, value in sorted(counters.items()):
+            lines += [f"# TYPE {PREFIX}_{name}_total counter", f"{PREFIX}_{name}_total {value:g}"]
+        for name, value in sorted(gauges.items()):
+            lines += [f"# TYPE {PREFIX}_{name} gauge", f"{PREFIX}_{name} {value:g}"]
+        for name, (kind, help, callback) in sorted(callbacks.items()):
+            try:
+                value = float(callback())
+            except Exception as e:
+                logger.warning(f"[WARN]: Cannot read metric {name}: {e}")
+                continue
+            if help:
+                lines.append(f"# HELP {PREFIX}_{name} {help}")
+            lines += [f"# TYPE {PREFIX}_{name} {kind}", f"{PREFIX}_{name} {value:g}"]
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = METRICS.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def serve_metrics(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve /metrics on `port` from a daemon thread.
+
+    Returns
+    -------
+    ThreadingHTTPServer
+        Running server, call `shutdown()` to stop it.
+
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"[INFO]: Metrics are served on port {server.server_address[1]}")
+    return server
@@ -0,0 +1,139 @@
+r"""Plotter: render salary charts to PNG in a worker process
+
+Rendering runs in a process pool with the headless Agg backend, so the
+bot process never holds matplotlib figures. Every figure is closed after
+rendering. Workers are started with "forkserver", the bot process is
+multithreaded and must not be forked. A pool broken by a dead worker is
+replaced on the next call.
+------------------------------------------------------------------------
+"""
+
+import io
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Swarm plot is super-linear in the number of points, larger samples are thinned
+MAX_SWARM_POINTS = 300
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def render_salary_plots(from_values: np.ndarray, to_values: np.ndarray,
+                        max_swarm_points: int = MAX_SWARM_POINTS) -> bytes:
+    """Draw From / To salary plots and return them as PNG.
+
+    Parameters
+    ----------
+    from_values : np.ndarray
+        Lower bounds of salaries in RUB, NaN if not set.
+    to_values : np.ndarray
+        Upper bounds of salaries in RUB, NaN if not set.
+    max_swarm_points : int
+        Maximum number of points in the swarm plot.
+
+    Returns
+    -------
+    bytes
+        PNG image.
+
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import pandas as pd
+    import seaborn as sns
+
+    sns.set()
+    df = pd.DataFrame({"From": from_values, "To": to_values})
+    both = df.dropna() / 1000
+    swarm = both
+    if len(swarm) > max_swarm_points:
+        swarm = swarm.sample(n=max_swarm_points, random_state=0)
+
+    fz = plt.figure("Salary plots", figsize=(12, 8))
+    try:
+        fz.add_subplot(2, 2, 1)
+        plt.title("From / To: Boxplot")
+        sns.boxplot(data=both, width=0.4)
+        plt.ylabel("Salary x 1000 [RUB]")
+        fz.add_subplot(2, 2, 2)
+        plt.title("From / To: Swarmplot")
+        sns.swarmplot(data=swarm, size=6 if len(swarm) <= 100 else 3)
+
+        fz.add_subplot(2, 2, 3)
+        plt.title("From: Distribution ")
+        sns.distplot(df["From"].dropna() / 1000, bins=14, color="C0")
+        plt.grid(True)
+        plt.xlabel("Salary x 1000 [RUB]")
+        plt.xlim([-50, df["From"].max() / 1000])
+        plt.yticks([], [])
+
+        fz.add_subplot(2, 2, 4)
+        plt.title("To: Distribution")
+        sns.distplot(df["To"].dropna() / 1000, bins=14, color="C1")
+        plt.grid(True)
+        plt.xlim([-50, df["To"].max() / 1000])
+        plt.xlabel("Salary x 1000 [RUB]")
+        plt.yticks([], [])
+        plt.tight_layout()
+
+        buffer = io.BytesIO()
+        fz.savefig(buffer, format="png", dpi=80)
+        return buffer.getvalue()
+    finally:
+        plt.close(fz)
+
+
+def get_executor(max_workers: int = 1) -> ProcessPoolExecutor:
+    """Return process-wide pool for rendering, create it on the first call."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=max_workers, mp_context=multiprocessing.get_context("forkserver"))
+        return _executor
+
+
+def reset_executor(broken: ProcessPoolExecutor):
+    """Drop `broken` pool, the next `get_executor` call creates a new one."""
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False)
+    logger.warning("[WARN]: Plot worker died, the pool is restarted")
+
+
+def _check_pool(executor: ProcessPoolExecutor, future: Future):
+    if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+        reset_executor(executor)
+
+
+def submit_salary_plots(from_values: np.ndarray, to_values: np.ndarray) -> Future:
+    """Render salary plots in the worker pool.
+
+    Returns
+    -------
+    Future
+        Future with PNG bytes.
+
+    """
+    from_values, to_values = np.asarray(from_values), np.asarray(to_values)
+    executor = get_executor()
+    try:
+        future = executor.submit(render_salary_plots, from_values, to_values)
+    except BrokenProcessPool:
+        reset_executor(executor)
+        executor = get_executor()
+        future = executor.submit(render_salary_plots, from_values, to_values)
+    future.add_done_callback(lambda done: _check_pool(executor, done))
+    return future
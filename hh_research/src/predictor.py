@@ -1,32 +1,181 @@
 r"""Predictor: getting words from vacancies (description, keywords) and
 make predictions for None salaries.
+
+One salary model is trained across all collected vacancies: features are
+hashed (see `features`), the regressor is updated with `partial_fit` as
+new vacancies arrive. The model is saved to disk, so a prediction is a
+transform and a dot product.
+------------------------------------------------------------------------
 """
 
+import os
+import tempfile
+import threading
+from typing import Optional, Set
+
+import joblib
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import seaborn as sns
-from nltk.corpus import stopwords as nltk_stopwords
-from scipy.sparse import hstack
-from sklearn.feature_extraction import DictVectorizer
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.linear_model import Ridge
+from sklearn.linear_model import SGDRegressor
 import logging
 
+from hh_research.src.features import HashingFeaturizer
+
 logger = logging.getLogger(__name__)
 
+MODEL_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), "cache", "salary_model.joblib")
+
+
+class SalaryModel:
+    r"""Salary regression on key skills, description, name and experience
+
+    Target is log of the average of From and To, so one model fits junior
+    and senior salaries.
+
+    Parameters
+    ----------
+    path : str
+        File of the saved model.
+    min_batch : int
+        Minimum number of vacancies with salary to start training.
+    warmup_epochs : int
+        Passes over the first batch.
+
+    """
+    # Saved models of other versions are not loaded
+    VERSION = 2
+
+    def __init__(self, path: str = MODEL_PATH, min_batch: int = 50, warmup_epochs: int = 10):
+        self.version = self.VERSION
+        self.path = path
+        self.min_batch = min_batch
+        self.warmup_epochs = warmup_epochs
+        self.featurizer = HashingFeaturizer()
+        self.regressor = SGDRegressor(alpha=1e-5, random_state=255)
+        self.trained_ids: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str = MODEL_PATH) -> "SalaryModel":
+        """Model saved to `path` or a new one if there is none."""
+        try:
+            model = joblib.load(path)
+            if getattr(model, "version", None) != cls.VERSION:
+                logger.info("[INFO]: Saved salary model is outdated, start a new one")
+                return cls(path)
+            model.path = path
+            logger.info(f"[INFO]: Salary model is loaded, trained on {len(model.trained_ids)} vacancies")
+            return model
+        except FileNotFoundError:
+            return cls(path)
+        except Exception as e:
+            logger.warning(f"[WARN]: Cannot load salary model, start a new one: {e}")
+            return cls(path)
+
+    def save(self):
+        """Write the model atomically, readers never see a partial file."""
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        os.close(fd)
+        try:
+            joblib.dump(self, tmp_path)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    @property
+    def is_fitted(self) -> bool:
+        return hasattr(self.regressor, "coef_")
+
+    def update(self, df: pd.DataFrame) -> int:
+        """Train on vacancies with salary which the model has not seen.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            Vacancies with From and To in RUB and full descriptions.
+
+        Returns
+        -------
+        int
+            Number of vacancies the model was trained on.
+
+        """
+        average = df[["From", "To"]].mean(axis=1)
+        with self._lock:
+            new = average.notna() & (average > 0) & ~df["Ids"].isin(self.trained_ids)
+            if not new.any():
+                return 0
+            train = df[new]
+            y = np.log(average[new].to_numpy(dtype=float))
+            epochs = 1
+            if not self.is_fitted:
+                if len(train) < self.min_batch:
+                    return 0
+                epochs = self.warmup_epochs
+
+            x = self.featurizer.transform(train)
+            for _ in range(epochs):
+                self.regressor.partial_fit(x, y)
+            self.trained_ids.update(train["Ids"])
+            try:
+                self.save()
+            except OSError as e:
+                logger.warning(f"[WARN]: Cannot save salary model: {e}")
+        logger.info(f"[INFO]: Salary model is trained on {len(train)} new vacancies")
+        return len(train)
+
+    def predict(self, df: pd.DataFrame) -> Optional[np.ndarray]:
+        """Predicted average salary in RUB for every row, None if not trained yet."""
+        with self._lock:
+            if not self.is_fitted:
+                return None
+            return np.exp(self.regressor.predict(self.featurizer.transform(df)))
+
+
+_model: Optional[SalaryModel] = None
+_model_lock = threading.Lock()
+
+
+def get_salary_model(path: str = MODEL_PATH) -> SalaryModel:
+    """Return process-wide salary model, load it on the first call."""
+    global _model
+    with _model_lock:
+        if _model is None:
+            _model = SalaryModel.load(path)
+        return _model
+
+
 class Predictor:
     """Predictor: getting words from vacancies (description, keywords) and
     make predictions for None salaries.
 
     """
 
-    @staticmethod
-    def text_replace(text) -> pd.Series:
-        """Clean text"""
-        prepared = pd.Series(
-            list(map(lambda x: [t.lower() for t in x], text.to_list())))
-        return prepared.replace("[^a-zA-Z]\bqout\b|\bamp\b", " ", regex=True)
+    def __init__(self, model: Optional[SalaryModel] = None):
+        self._model = model
+
+    @property
+    def model(self) -> SalaryModel:
+        if self._model is None:
+            self._model = get_salary_model()
+        return self._model
 
     @staticmethod
     def prepare_dataframe(df: pd.DataFrame) -> pd.DataFrame:
@@ -55,75 +204,39 @@ class Predictor:
         plt.tight_layout()
         plt.show()
 
-    def predict(self, df: pd.DataFrame, min_df_threshold: int = 5) -> pd.DataFrame:
-        """Prepare data frame and save results
+    def update(self, df: pd.DataFrame) -> int:
+        """Train the shared model on new vacancies with salary, see `SalaryModel.update`."""
+        return self.model.update(df)
+
+    def predict(self, df: pd.DataFrame) -> Optional[pd.DataFrame]:
+        """Predict salaries of vacancies without From and To
 
         Parameters
         ----------
         df: pd.DataFrame
             Dict of parsed vacancies.
-        min_df_threshold: int
-            Threshold for document freq.
+
+        Returns
+        -------
+        pd.DataFrame
+            Vacancies without salary with "Average" predicted salary, None
+            if the model is not trained yet.
 
         """
-        # Create pandas dataframe
-        # Set TF-IDF features
-        stopwords_ru = set(nltk_stopwords.words("russian"))
-        stopwords_en = set(nltk_stopwords.words("english"))
-        stopwords = stopwords_ru | stopwords_en
-
-        new_df = self.prepare_dataframe(df)
-        tf_idf = TfidfVectorizer(min_df=min_df_threshold, stop_words=stopwords)
-
-        # Training set
-        txt = self.text_replace(new_df["Keys"])
-        print(txt)
-        logging.info(txt)
-        x_train_text = tf_idf.fit_transform(txt)
-
-        # Print top words used in keys
-        idx = np.ravel(x_train_text.sum(axis=0).argsort(axis=1))[::-1][:7]
-        top_words = np.array(tf_idf.get_feature_names())[idx].tolist()
-        logging.info("Top words used in keys: {}".format(top_words))
-        print("Top words used in keys: {}".format(top_words))
-
-        # One-hot-encoding for data frame features
-        dct_enc = DictVectorizer()
-        x_train_cat = dct_enc.fit_transform(
-            new_df[["Experience", "Name"]].to_dict("Records"))
-
-        # Stack vectors
-        x_train = hstack([x_train_text, x_train_cat])
-
-        y_train = new_df["Average"]
-        model = Ridge(alpha=1, random_state=255)
-        model.fit(x_train, y_train)
-
-        # Frame with NaNs
         x_test = df[df["From"].isna() & df["To"].isna()]
-
-        # Test vectors
-        x_test_text = tf_idf.transform(
-            self.text_replace(x_test["Description"]))
-        x_test_cat = dct_enc.transform(
-            x_test[["Experience", "Name"]].to_dict("Records"))
-        x_test = hstack([x_test_text, x_test_cat])
-
-        # Prediction model - result
-        y_test = model.predict(x_test)
-        logging.info(
+        if x_test.empty:
+            return None
+        y_test = self.model.predict(x_test)
+        if y_test is None:
+            logger.info("[INFO]: Salary model is not trained yet")
+            return None
+
+        logger.info(
             f"[INFO]: Salary for vacancies with NaN:\n"
-            f"Average is {y_test.mean(dtype=int)}"
-            f"Maximum is {y_test.max(dtype=int)}"
-            f"Maximum is {y_test.min(dtype=int)}"
+            f"Average is {y_test.mean():.0f}\n"
+            f"Maximum is {y_test.max():.0f}\n"
+            f"Minimum is {y_test.min():.0f}"
         )
-        print(
-            f"[INFO]: Salary for vacancies with NaN:\n"
-            f"Average is {y_test.mean(dtype=int)}"
-            f"Maximum is {y_test.max(dtype=int)}"
-            f"Maximum is {y_test.min(dtype=int)}"
-        )
-
         df_tst = x_test.drop(["Salary", "From", "To"], axis=1)
         df_tst.insert(3, "Average", y_test.astype(int))
         return df_tst
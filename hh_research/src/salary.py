@@ -0,0 +1,64 @@
+r"""Salary normalization: raw amounts in any currency to net RUB
+
+Vacancies keep raw salary bounds, currency and gross flag, so they can
+be re-priced with fresh exchange rates without fetching them again.
+Columns are converted in one vectorized pass.
+------------------------------------------------------------------------
+"""
+
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# hh.ru still reports rubles with the old ISO code
+CURRENCY_ALIASES = {"RUR": "RUB"}
+# Personal income tax, gross salary is converted to net
+NET_RATE = 0.87
+
+
+def currency_rate(currency: Optional[str], rates: Dict) -> float:
+    """Units of `currency` per RUB, NaN if the currency is unknown."""
+    if currency is None:
+        return np.nan
+    rate = rates.get(CURRENCY_ALIASES.get(currency, currency), rates.get(currency))
+    return rate if rate else np.nan
+
+
+def convert_salary(amount: Optional[float], currency: Optional[str], gross: bool, rates: Dict) -> Optional[float]:
+    """Convert one salary bound to net RUB, None if it cannot be converted."""
+    if amount is None:
+        return None
+    value = amount * (NET_RATE if gross else 1) / currency_rate(currency, rates)
+    return None if np.isnan(value) else value
+
+
+def normalize_salaries(amounts: Sequence[np.ndarray], currencies, gross: np.ndarray,
+                       rates: Dict) -> Sequence[np.ndarray]:
+    """Convert salary columns to net RUB.
+
+    Parameters
+    ----------
+    amounts : list of np.ndarray
+        Raw salary bounds (e.g. From and To), NaN if not set.
+    currencies : pd.Categorical or array-like
+        Currency code of each vacancy, missing values allowed.
+    gross : np.ndarray
+        True if the salary is given before tax.
+    rates : dict
+        Units of currency per RUB: {"RUB": 1, "USD": 0.0126, ...}.
+
+    Returns
+    -------
+    list of np.ndarray
+        Bounds in RUB truncated to integer values, NaN if the bound is not
+        set or the currency is unknown.
+
+    """
+    currencies = pd.Categorical(currencies)
+    # One rate lookup per currency, not per vacancy
+    category_rates = np.array([currency_rate(c, rates) for c in currencies.categories] + [np.nan])
+    # Missing currency has code -1 and takes the trailing NaN
+    rate = category_rates[currencies.codes]
+    net = np.where(np.asarray(gross, dtype=bool), NET_RATE, 1.0)
+    return [np.trunc(np.asarray(values, dtype=np.float64) * net / rate) for values in amounts]
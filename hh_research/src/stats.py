@@ -0,0 +1,109 @@
+r"""Running salary statistics for partial reports
+
+Values are added one by one while vacancies are collected: count, min,
+max and mean are exact, median is estimated with the P-square algorithm
+(Jain & Chlamtac, 1985) in constant memory.
+------------------------------------------------------------------------
+"""
+
+import math
+from typing import List, Optional
+
+
+class P2Quantile:
+    r"""Streaming estimate of a quantile with five markers
+
+    Parameters
+    ----------
+    p : float
+        Quantile to estimate, 0.5 for median.
+
+    """
+
+    def __init__(self, p: float = 0.5):
+        self.p = p
+        self._heights: List[float] = []
+        self._positions = [1, 2, 3, 4, 5]
+        self._desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self._increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, value: float):
+        heights = self._heights
+        if len(heights) < 5:
+            heights.append(value)
+            heights.sort()
+            return
+
+        # Find cell k of the new value and update extreme markers
+        if value < heights[0]:
+            heights[0] = value
+            k = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            k = 3
+        else:
+            k = 0
+            while value >= heights[k + 1]:
+                k += 1
+
+        for i in range(k + 1, 5):
+            self._positions[i] += 1
+        for i in range(5):
+            self._desired[i] += self._increments[i]
+
+        # Adjust heights of middle markers
+        for i in range(1, 4):
+            d = self._desired[i] - self._positions[i]
+            if (d >= 1 and self._positions[i + 1] - self._positions[i] > 1) or \
+                    (d <= -1 and self._positions[i - 1] - self._positions[i] < -1):
+                step = 1 if d > 0 else -1
+                height = self._parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = self._linear(i, step)
+                heights[i] = height
+                self._positions[i] += step
+
+    def _parabolic(self, i: int, d: int) -> float:
+        q, n = self._heights, self._positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def _linear(self, i: int, d: int) -> float:
+        q, n = self._heights, self._positions
+        return q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+
+    @property
+    def value(self) -> Optional[float]:
+        heights = self._heights
+        if not heights:
+            return None
+        if len(heights) < 5:
+            # Exact quantile of few values
+            index = self.p * (len(heights) - 1)
+            low, high = math.floor(index), math.ceil(index)
+            return heights[low] + (heights[high] - heights[low]) * (index - low)
+        return heights[2]
+
+
+class RunningStats:
+    """Count, min, max, mean and estimated median of a stream of values."""
+
+    def __init__(self):
+        self.count = 0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self.mean = 0.0
+        self._median = P2Quantile(0.5)
+
+    def add(self, value: float):
+        self.count += 1
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.mean += (value - self.mean) / self.count
+        self._median.add(value)
+
+    @property
+    def median(self) -> Optional[float]:
+        return self._median.value
@@ -0,0 +1,69 @@
+r"""Text processing for vacancy descriptions: tokenizer and stop words
+
+Patterns are compiled once on import. Descriptions are cleaned and
+tokenized once, when a vacancy is collected, the joined corpus is never
+built. Stop words (NLTK lists for English and Russian) are bundled in
+`data/` and read once.
+------------------------------------------------------------------------
+"""
+
+import os
+import re
+from functools import lru_cache
+from typing import AbstractSet, FrozenSet, Iterable, Iterator, List
+
+DATA_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "data")
+# HTML entities left in descriptions
+EXTRA_STOP_WORDS = frozenset({"amp", "quot", "nbsp"})
+
+TAG_PATTERN = re.compile(r"<.*?>")
+# Latin and Cyrillic words, applied to lowercased text
+WORD_PATTERN = re.compile(r"[a-zа-яё]+")
+MIN_WORD_LENGTH = 3
+
+
+def clean_tags(html_text: str) -> str:
+    """Remove HTML tags from the string."""
+    return TAG_PATTERN.sub("", html_text)
+
+
+def tokenize(text: str, stop_words: AbstractSet[str] = frozenset()) -> List[str]:
+    """Split text into lowercase words.
+
+    Parameters
+    ----------
+    text : str
+        Input text without HTML tags.
+    stop_words : set
+        Words to drop.
+
+    Returns
+    -------
+    list
+        Words of at least `MIN_WORD_LENGTH` letters which are not stop words.
+
+    """
+    return [
+        word for word in WORD_PATTERN.findall(text.lower())
+        if len(word) >= MIN_WORD_LENGTH and word not in stop_words
+    ]
+
+
+def iter_tokens(texts: Iterable[str], stop_words: AbstractSet[str] = frozenset()) -> Iterator[str]:
+    """Stream words of many texts, one text at a time."""
+    for text in texts:
+        if text:
+            yield from tokenize(text, stop_words)
+
+
+@lru_cache(maxsize=None)
+def load_stop_words(language: str) -> FrozenSet[str]:
+    """Stop words of `language` ("english" or "russian") from bundled lists."""
+    with open(os.path.join(DATA_DIR, f"stopwords_{language}.txt"), encoding="utf-8") as f:
+        return frozenset(line.strip() for line in f if line.strip())
+
+
+@lru_cache(maxsize=None)
+def get_stop_words() -> FrozenSet[str]:
+    """English and Russian stop words plus project extras."""
+    return load_stop_words("english") | load_stop_words("russian") | EXTRA_STOP_WORDS
@@ -0,0 +1,102 @@
+r"""Vacancy record: compact parsed vacancy
+
+Parsed vacancies wait in pipeline queues and in `Collector.collect_many`
+until they are added to `VacancyColumns`. Records use `__slots__`,
+repeated strings (experience, schedule, employer, currency, key skills)
+are interned, long descriptions can be kept zlib-compressed.
+------------------------------------------------------------------------
+"""
+
+import sys
+import zlib
+from typing import Dict, List, Optional, Union
+
+from hh_research.src.salary import convert_salary
+
+# Column names in order of `Vacancy.as_row`
+COLUMNS = (
+    "Ids",
+    "Employer",
+    "Name",
+    "Salary",
+    "From",
+    "To",
+    "Currency",
+    "Gross",
+    "Experience",
+    "Schedule",
+    "Keys",
+    "Description",
+    "Tokens",
+)
+# Shorter descriptions are not worth compressing
+COMPRESS_MIN_LENGTH = 256
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Vacancy:
+    r"""One parsed vacancy
+
+    Parameters
+    ----------
+    compress : bool
+        Keep description zlib-compressed until the record is added to
+        columns, see `as_row`.
+
+    """
+    __slots__ = (
+        "id", "employer", "name", "salary", "salary_from", "salary_to", "currency", "gross",
+        "experience", "schedule", "keys", "_description", "tokens",
+    )
+
+    def __init__(self, id: str, employer: Optional[str], name: str, salary: bool,
+                 salary_from: Optional[float], salary_to: Optional[float], currency: Optional[str], gross: bool,
+                 experience: Optional[str], schedule: Optional[str], keys: List[str], description: str,
+                 tokens: List[str], compress: bool = False):
+        self.id = _intern(id)
+        self.employer = _intern(employer)
+        self.name = _intern(name)
+        self.salary = salary
+        self.salary_from = salary_from
+        self.salary_to = salary_to
+        self.currency = _intern(currency)
+        self.gross = gross
+        self.experience = _intern(experience)
+        self.schedule = _intern(schedule)
+        self.keys = [sys.intern(el) for el in keys]
+        self.tokens = [sys.intern(el) for el in tokens]
+        self._description: Union[str, bytes] = description
+        if compress and len(description) >= COMPRESS_MIN_LENGTH:
+            self._description = zlib.compress(description.encode("utf-8"))
+
+    @property
+    def description(self) -> str:
+        if isinstance(self._description, bytes):
+            return zlib.decompress(self._description).decode("utf-8")
+        return self._description
+
+    def as_row(self) -> tuple:
+        """Values in order of `COLUMNS`.
+
+        The description is decompressed once and kept, so rows of a record
+        shared by several searches share one string.
+        """
+        description = self._description = self.description
+        return (
+            self.id, self.employer, self.name, self.salary, self.salary_from, self.salary_to, self.currency,
+            self.gross, self.experience, self.schedule, self.keys, description, self.tokens,
+        )
+
+    def average_salary(self, rates: Dict) -> Optional[float]:
+        """Mean of From and To in RUB if both are known."""
+        salary_from = convert_salary(self.salary_from, self.currency, self.gross, rates)
+        salary_to = convert_salary(self.salary_to, self.currency, self.gross, rates)
+        if salary_from is None or salary_to is None:
+            return None
+        return (salary_from + salary_to) / 2
+
+    def __repr__(self) -> str:
+        return f"Vacancy(id={self.id!r}, name={self.name!r}, employer={self.employer!r})"
@@ -0,0 +1,332 @@
+"""Vacancy analysis for the bot: runs Researcher and shares its results between users"""
+import copy
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from cachetools import TTLCache
+
+from hh_research.researcher import Researcher
+from hh_research.src.cache import normalize_query
+from hh_research.src.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "options": {
+        "text": "Data Science", "area": 1, "per_page": 50
+    },
+    "refresh": False, "max_workers": 7, "save_result": False,
+    "cache_ttl": 6 * 3600, "cache_size": 20000,
+    # The async engine opens a connection per request, threads share the keep-alive pool
+    "engine": "threads", "incremental": True,
+    "pool_size": 16, "retries": 3, "backoff_factor": 0.5,
+    # Vacancies go straight to columns in the bot, compression would only cost CPU
+    "compress_descriptions": False,
+    "rates": {
+        "USD": 0.012641, "EUR": 0.010831, "UAH": 0.35902, "RUB": 1
+    }
+}
+# Background precomputation shares the API rate limit with users, so it is slower
+PRECOMPUTE_INTERVAL = 3600
+# Precomputed reports must outlive the interval plus a run of precomputation,
+# which takes tens of minutes
+REPORT_TTL = 3 * PRECOMPUTE_INTERVAL
+PRECOMPUTE_SETTINGS = {"max_workers": 2}
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Runs one computation per key at a time, concurrent callers with
+    the same key wait for it and get the same result"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._calls
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            logger.info("Joined in-flight analysis %s", key)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class ReportCache:
+    """Thread-safe TTL cache of finished reports with hit/miss counters.
+    When maxsize is reached the least recently used report is evicted"""
+
+    def __init__(self, maxsize: int = 256, ttl: float = 3600):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable):
+        with self._lock:
+            report = self._cache.get(key)
+            if report is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return report
+
+    def put(self, key: Hashable, report):
+        with self._lock:
+            self._cache[key] = report
+
+    def __len__(self):
+        with self._lock:
+            return len(self._cache)
+
+
+class QueryCounter:
+    """Thread-safe counter of requested search texts.
+
+    Counts are halved by decay() and when more than max_size texts are
+    counted, texts which drop to zero are forgotten"""
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def add(self, text: str):
+        with self._lock:
+            self._counts[" ".join(text.lower().split())] += 1
+            if len(self._counts) > self.max_size:
+                self._decay()
+
+    def decay(self):
+        with self._lock:
+            self._decay()
+
+    def _decay(self):
+        self._counts = Counter({text: count // 2 for text, count in self._counts.items() if count > 1})
+
+    def __len__(self):
+        with self._lock:
+            return len(self._counts)
+
+    def most_common(self, n: int) -> List[str]:
+        with self._lock:
+            return [text for text, _ in self._counts.most_common(n)]
+
+
+class QueueFull(Exception):
+    """All workers are busy and the waiting line is full"""
+
+
+class UserLimitExceeded(Exception):
+    """The user already has the maximum number of analyses in progress"""
+
+
+class AnalysisQueue:
+    """Bounded pool of analysis workers outside of the bot dispatcher.
+
+    At most max_workers analyses run at once and at most max_pending
+    wait for a worker. One user can have at most per_user analyses
+    running or waiting"""
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 20, per_user: int = 1):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.per_user = per_user
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis")
+        self._lock = threading.Lock()
+        self._waiting: List[object] = []
+        self._running = 0
+        self._per_user = Counter()
+
+    def submit(self, user_id: Hashable, fn: Callable, *args, **kwargs) -> Tuple[Future, int]:
+        """Schedule fn(*args, **kwargs) for user_id.
+
+        Returns (future, position): position is 0 if the analysis starts
+        right away, otherwise its number in the waiting line.
+
+        Raises QueueFull or UserLimitExceeded if the job is not accepted"""
+        ticket = object()
+        with self._lock:
+            if self._per_user[user_id] >= self.per_user:
+                raise UserLimitExceeded(user_id)
+            if len(self._waiting) >= self.max_pending:
+                raise QueueFull()
+            self._per_user[user_id] += 1
+            position = 0
+            if self._running + len(self._waiting) >= self.max_workers:
+                self._waiting.append(ticket)
+                position = len(self._waiting)
+            else:
+                self._running += 1
+
+        def run():
+            with self._lock:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    self._running += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._per_user[user_id] -= 1
+                    if self._per_user[user_id] <= 0:
+                        del self._per_user[user_id]
+
+        METRICS.inc("queued_analyses")
+        return self._executor.submit(run), position
+
+    @property
+    def waiting(self) -> int:
+        with self._lock:
+            return len(self._waiting)
+
+
+ANALYSES = SingleFlight()
+REPORTS = ReportCache(ttl=REPORT_TTL)
+QUERIES = QueryCounter()
+JOBS = AnalysisQueue()
+METRICS.register("report_cache_hits_total", lambda: REPORTS.hits, "Reports taken from cache", kind="counter")
+METRICS.register("report_cache_misses_total", lambda: REPORTS.misses, "Reports missing in cache", kind="counter")
+METRICS.register("report_cache_entries", lambda: len(REPORTS), "Reports in cache")
+METRICS.register("counted_queries", lambda: len(QUERIES), "Search texts counted for precomputation")
+METRICS.register("analysis_queue_waiting", lambda: JOBS.waiting, "Analyses waiting for a worker")
+
+
+def make_settings(text: str, **overrides) -> Dict:
+    """Researcher settings for search text, copied from DEFAULT_SETTINGS"""
+    settings_dict = copy.deepcopy(DEFAULT_SETTINGS)
+    settings_dict['options']['text'] = text
+    settings_dict.update(overrides)
+    return settings_dict
+
+
+def _analyze(key: str, settings_dict: Dict, on_preliminary: Optional[Callable] = None,
+             on_progress: Optional[Callable] = None):
+    hh_analyzer = Researcher(settings_dict=settings_dict)
+    hh_analyzer.update()
+    # Salaries from search results come in seconds, skills and descriptions take longer
+    report = hh_analyzer(fast=True, progress=on_progress)
+    if report[0] is None:
+        return report
+    # Incremental updates of known queries are full reports already
+    if not hh_analyzer.has_details:
+        if on_preliminary is not None:
+            on_preliminary(report)
+        report = hh_analyzer.details(progress=on_progress)
+    if report[0] is not None:
+        REPORTS.put(key, report)
+    return report
+
+
+def run_analysis(settings_dict: Dict, on_preliminary: Optional[Callable] = None,
+                 on_progress: Optional[Callable] = None):
+    """Returns report of Researcher for settings_dict['options'].
+
+    Reports are cached by normalized query, settings_dict['refresh']
+    bypasses the cache. Identical analyses running at the same time are
+    computed once. on_preliminary(report) gets the fast salary-only
+    report and on_progress(progress) gets researcher.Progress while
+    vacancies are collected. Both are called only for the caller which
+    really runs the analysis"""
+    key = normalize_query(settings_dict['options'])
+    # Cache hits count too, or popular queries drop out of precomputation
+    QUERIES.add(settings_dict['options']['text'])
+    if not settings_dict.get('refresh'):
+        report = REPORTS.get(key)
+        if report is not None:
+            logger.info("Report for %s is taken from cache", key)
+            return report
+    METRICS.inc("analyses")
+    return ANALYSES.do(key, _analyze, key, settings_dict, on_preliminary, on_progress)
+
+
+def _precompute_one(key: str, settings_dict: Dict):
+    hh_analyzer = Researcher(settings_dict=settings_dict)
+    hh_analyzer.update()
+    report = hh_analyzer(fast=False)
+    if report[0] is not None:
+        REPORTS.put(key, report)
+    return report
+
+
+def precompute(queries: Iterable[str], pause: float = 10.0):
+    """Compute reports for search texts one by one and put them into REPORTS.
+
+    Runs with PRECOMPUTE_SETTINGS and sleeps pause seconds between
+    searches to stay under the API rate limit. A search which users
+    are analyzing right now is skipped, their report goes to REPORTS.
+    Users never wait for the slower precomputation of their search"""
+    for i, text in enumerate(dict.fromkeys(queries)):
+        if i:
+            time.sleep(pause)
+        settings_dict = make_settings(text, **PRECOMPUTE_SETTINGS)
+        key = normalize_query(settings_dict['options'])
+        if ANALYSES.in_flight(key):
+            continue
+        try:
+            with METRICS.timer("precompute"):
+                ANALYSES.do(("precompute", key), _precompute_one, key, settings_dict)
+        except Exception as e:
+            logger.warning("Cannot precompute report for %s: %s", text, e)
+
+
+def start_precompute(spheres: Iterable[str], scheduler: Optional[BackgroundScheduler] = None,
+                     interval: float = PRECOMPUTE_INTERVAL, top: int = 10,
+                     pause: float = 10.0) -> BackgroundScheduler:
+    """Precompute reports for spheres and top requested texts every interval seconds.
+
+    Every run puts fresh reports into REPORTS. REPORT_TTL is longer than
+    the interval plus the run time, so precomputed reports are replaced
+    before they expire. A run which takes longer than interval is not
+    started twice. Counts of requested texts decay every run, so texts
+    which are not requested anymore drop out of the top"""
+    spheres = list(spheres)
+    if scheduler is None:
+        scheduler = BackgroundScheduler(daemon=True)
+
+    def run():
+        queries = spheres + QUERIES.most_common(top)
+        QUERIES.decay()
+        precompute(queries, pause=pause)
+
+    scheduler.add_job(run,
+                      "interval", seconds=interval, next_run_time=datetime.now(),
+                      id="precompute_reports", replace_existing=True, coalesce=True, max_instances=1)
+    if not scheduler.running:
+        scheduler.start()
+    return scheduler
@@ -1,10 +1,12 @@
 from src.utils import build_menu
 from telegram.ext import CallbackContext, ConversationHandler
 from telegram import (
-    InlineKeyboardButton, InlineKeyboardMarkup,
+    Bot, InlineKeyboardButton, InlineKeyboardMarkup,
     ReplyKeyboardMarkup, ReplyKeyboardRemove, Update)
-import hh_research.researcher
+from src.analysis import JOBS, QueueFull, UserLimitExceeded, make_settings, run_analysis
 import pandas as pd
+import io
+from functools import lru_cache
 import logging
 import pandas as pd
 import sys
@@ -21,9 +23,10 @@ SPHERES = [
     'Контент и дизайн', 'Логистика и Supply Chain', 'Маркетинг и PR', 'Менеджмент', 'Продажи',
     'HR (Управление персоналом)', 'Финансы', 'Не знаю'
 ]
+# Spheres which are searched on hh.ru, reports for them are precomputed
+SEARCHABLE_SPHERES = [sphere for sphere in SPHERES if sphere != 'Не знаю']
 
-PROF_MATRIX = pd.read_excel('https://raw.githubusercontent.com/harbachonakk/files-for-heroku/main/professions_matrix.xlsx',
-                            header=0)
+PROF_MATRIX_URL = 'https://raw.githubusercontent.com/harbachonakk/files-for-heroku/main/professions_matrix.xlsx'
 
 ANS1 = 0
 ANS2 = 0
@@ -173,6 +176,7 @@ def analyze(update: Update, context: CallbackContext) -> int:
 
 
 def vacancy(update: Update, context: CallbackContext) -> int:
+    """Puts vacancy analysis into the job queue, the report is sent when it is ready"""
     logger.info("def vacancy working")
     vacancy = None
     if (update.message is not None):
@@ -180,9 +184,6 @@ def vacancy(update: Update, context: CallbackContext) -> int:
         logger.info("Chosen vacancy of %s: %s",
                     user.first_name, update.message.text)
         vacancy = update.message.text
-        text = (f'Начинаю делать для Вас анализ вакансии {vacancy}...'
-                '\nПодготовка отчета может занять до нескольких минут, не уходите далеко :)')
-        update.message.reply_text(text=text)
     else:
         query = update.callback_query
         query.answer()
@@ -190,33 +191,80 @@ def vacancy(update: Update, context: CallbackContext) -> int:
         logger.info("Chosen vacancy of %s: %s",
                     user.first_name, query.data)
         vacancy = query.data
-        text = (f'Начинаю делать для Вас анализ вакансии {vacancy}...'
-                '\nПодготовка отчета может занять до нескольких минут, не уходите далеко :)')
-        query.edit_message_text(text=text)
 
-    settings_dict = {
-        "options": {
-            "text": "Data Science", "area": 1, "per_page": 50
-        },
-        "refresh": True, "max_workers": 7, "save_result": False,
-        "rates": {
-            "USD": 0.012641, "EUR": 0.010831, "UAH": 0.35902, "RUB": 1
-        }
-    }
-    settings_dict['options']['text'] = vacancy
-
-    hh_analyzer = hh_research.researcher.Researcher(
-        settings_dict=settings_dict)
-    hh_analyzer.update()
-    num_of_vacancies, max_salary, min_salary, mean_salary, median_salary, most_keys, most_words = hh_analyzer()
+    # The crawl takes minutes, it must not block the dispatcher
+    try:
+        _, position = JOBS.submit(user.id, analyze_vacancy, context.bot, update.effective_chat.id, vacancy)
+    except UserLimitExceeded:
+        update.effective_message.reply_text('Ваш предыдущий анализ еще готовится, я пришлю отчет, как только он будет готов')
+        return OPTIONS
+    except QueueFull:
+        update.effective_message.reply_text('Сейчас слишком много запросов на анализ :( '
+                                            'Пожалуйста, напишите название вакансии еще раз через несколько минут')
+        return VACANCY
+
+    text = (f'Начинаю делать для Вас анализ вакансии {vacancy}...'
+            '\nПодготовка отчета может занять до нескольких минут, не уходите далеко :)')
+    if position:
+        text = (f'Анализ вакансии {vacancy} поставлен в очередь, Вы #{position} в очереди.'
+                '\nЯ пришлю отчет, как только он будет готов :)')
+    if update.message is not None:
+        update.message.reply_text(text=text)
+    else:
+        update.callback_query.edit_message_text(text=text)
+    return OPTIONS
+
+
+def analyze_vacancy(bot: Bot, chat_id: int, vacancy: str):
+    """Runs analysis in JOBS worker and sends the report to chat_id"""
+    try:
+        send_vacancy_report(bot, chat_id, vacancy)
+    except Exception:
+        logger.exception("Analysis of %s failed", vacancy)
+        bot.send_message(chat_id, f'Не получилось сделать анализ вакансии {vacancy} :( Попробуйте еще раз позже')
+
+
+def send_vacancy_report(bot: Bot, chat_id: int, vacancy: str):
+    settings_dict = make_settings(vacancy)
+
+    def send_preliminary(report):
+        num_of_vacancies, max_salary, min_salary, mean_salary, median_salary, *_ = report
+        bot.send_message(chat_id, f"Предварительный отчет по {num_of_vacancies} вакансиям:\n"
+                                  f"{max_salary}\n"
+                                  f"{min_salary}\n"
+                                  f"{mean_salary}\n"
+                                  f"{median_salary}\n\n"
+                                  "Теперь собираю навыки и описания вакансий...")
+
+    progress_message = None
+
+    def send_progress(progress):
+        nonlocal progress_message
+        salaries = progress.salaries
+        text = f'Обработано вакансий: {progress.collected}'
+        if salaries.count:
+            text += (f'\nИз них с зарплатной вилкой: {salaries.count}'
+                     f'\nМаксимальная зарплата   : {salaries.max:.0f} RUB'
+                     f'\nМинимальная зарплата   : {salaries.min:.0f} RUB'
+                     f'\nСредняя зарплата   : {salaries.mean:.0f} RUB'
+                     f'\nМедианная зарплата (оценка)   : {salaries.median:.0f} RUB')
+        if progress_message is None:
+            progress_message = bot.send_message(chat_id, text)
+        else:
+            progress_message.edit_text(text)
+
+    (num_of_vacancies, max_salary, min_salary, mean_salary, median_salary, most_keys, most_words, chart,
+     predicted_salary) = run_analysis(settings_dict, on_preliminary=send_preliminary, on_progress=send_progress)
     if num_of_vacancies is not None:
-        update.effective_message.reply_text("Отчет готов! Давайте смотреть:\n"
-                                            f"{max_salary}\n"
-                                            f"{min_salary}\n"
-                                            f"{mean_salary}\n"
-                                            f"{median_salary}\n\n"
-                                            f"Самые популярные навыки и количество вхождений:\n{most_keys}\n\n"
-                                            f"Самые популярные слова и количество вхождений:\n{most_words}\n\n")
+        predicted = f"{predicted_salary}\n" if predicted_salary else ""
+        bot.send_message(chat_id, "Отчет готов! Давайте смотреть:\n"
+                                  f"{max_salary}\n"
+                                  f"{min_salary}\n"
+                                  f"{mean_salary}\n"
+                                  f"{median_salary}\n"
+                                  f"{predicted}\n"
+                                  f"Самые популярные навыки и количество вхождений:\n{most_keys}\n\n"
+                                  f"Самые популярные слова и количество вхождений:\n{most_words}\n\n")
 
     button_list = [
         InlineKeyboardButton("Пройти краткий тест", callback_data='1'),
@@ -226,15 +274,15 @@ def vacancy(update: Update, context: CallbackContext) -> int:
     ]
     reply_markup = InlineKeyboardMarkup(build_menu(button_list, n_cols=1))
 
-    update.effective_message.reply_text("В резюме, как правило, работодатели указывают зарплатную вилку: диапазон, в котором вакансия будет оплачиваться. "
-                                        f"Вот так на данный момент выглядят распределения зарплат От и До для вакансии {vacancy} в Москве, "
-                                        "где От - нижняя граница зарплатной вилки, а До - верхняя. "
-                                        "Обратите внимание на первый график - график с усами. Средняя черта внутри цветного прямоугольника - "
-                                        "диапазона наиболее обычных зарплат - означает медианную зарплату: такую, что ровно половина предложений - "
-                                        "меньше, а половина - больше. ")
-    update.effective_message.reply_text(
-        'Как-то так! Чем займемся дальше?', reply_markup=reply_markup)
-    return OPTIONS
+    bot.send_message(chat_id, "В резюме, как правило, работодатели указывают зарплатную вилку: диапазон, в котором вакансия будет оплачиваться. "
+                              f"Вот так на данный момент выглядят распределения зарплат От и До для вакансии {vacancy} в Москве, "
+                              "где От - нижняя граница зарплатной вилки, а До - верхняя. "
+                              "Обратите внимание на первый график - график с усами. Средняя черта внутри цветного прямоугольника - "
+                              "диапазона наиболее обычных зарплат - означает медианную зарплату: такую, что ровно половина предложений - "
+                              "меньше, а половина - больше. ")
+    if chart is not None:
+        bot.send_photo(chat_id, photo=io.BytesIO(chart))
+    bot.send_message(chat_id, 'Как-то так! Чем займемся дальше?', reply_markup=reply_markup)
 
 
 def info(update: Update, context: CallbackContext) -> int:
@@ -314,9 +362,16 @@ def simple_test_q2(update: Update, context: CallbackContext) -> int:
     return SIMPLE_TEST_PASSED
 
 
+@lru_cache(maxsize=1)
+def get_prof_matrix() -> pd.DataFrame:
+    """Professions matrix of the simple test, downloaded on first use.
+    Plot workers import this module too, they must not depend on GitHub"""
+    return pd.read_excel(PROF_MATRIX_URL, header=0)
+
+
 def simple_test_res(update: Update, context: CallbackContext) -> int:
     """Stores answer to Q1 and tell result of simple test"""
-    res = str(PROF_MATRIX.iloc[ANS1, ANS2+1])
+    res = str(get_prof_matrix().iloc[ANS1, ANS2+1])
     text = (
         'По результатам краткого самотестирования могу Вам посоветовать подумать о следующих профессиях:\n' + res +
         '\n\nЧем займемся теперь? :)'
@@ -0,0 +1,139 @@
+"""Collector engines against a local stub of the hh.ru API"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from hh_research.src.collector import Collector
+from hh_research.src.http_session import configure_session
+
+N_VACANCIES = 230
+QUERY = {"text": "python", "per_page": 50}
+
+
+def vacancy(i: int) -> dict:
+    return {
+        "id": str(i), "name": f"Python developer {i % 7}", "employer": {"name": f"Employer {i % 11}"},
+        "salary": {"from": 100000 + i, "to": None, "currency": "RUR", "gross": False} if i % 2 else None,
+        "experience": {"name": "От 1 года до 3 лет"}, "schedule": {"name": "Полный день"},
+        "key_skills": [{"name": "Python"}, {"name": "SQL"}],
+        "description": f"<p>Python developer with SQL skills, vacancy {i}</p>",
+        "published_at": "2026-10-10T10:00:00+0300",
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Set by the fixture: {"missing": ids answered with 404, "flaky": ids answered with one 503}
+    server_state = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        state = self.server_state
+        if url.path == "/vacancies/":
+            page = int(parse_qs(url.query)["page"][0])
+            per_page = int(parse_qs(url.query)["per_page"][0])
+            ids = range(page * per_page, min((page + 1) * per_page, N_VACANCIES))
+            items = [{k: v for k, v in vacancy(i).items() if k not in ("key_skills", "description")} for i in ids]
+            body = {"items": items, "found": N_VACANCIES, "pages": -(-N_VACANCIES // per_page), "page": page}
+        else:
+            vacancy_id = int(url.path.rsplit("/", 1)[1])
+            with state["lock"]:
+                state["details"] += 1
+                flaky = vacancy_id in state["flaky"]
+                state["flaky"].discard(vacancy_id)
+            if vacancy_id in state["missing"]:
+                return self._reply(404, {"errors": [{"type": "not_found"}]})
+            if flaky:
+                return self._reply(503, {"errors": [{"type": "unavailable"}]}, {"Retry-After": "0"})
+            body = vacancy(vacancy_id)
+        self._reply(200, body)
+
+    def _reply(self, code: int, body: dict, headers: dict = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def stub():
+    configure_session(pool_size=8, retries=3, backoff_factor=0.01)
+    state = {"lock": threading.Lock(), "details": 0, "missing": {3, 150}, "flaky": {7, 42}}
+    handler = type("Handler", (StubHandler,), {"server_state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield Collector(api_url=f"http://127.0.0.1:{server.server_port}/vacancies/"), state
+    server.shutdown()
+    server.server_close()
+
+
+def collect(collector: Collector, engine: str, **kwargs):
+    if engine == "async":
+        return asyncio.run(collector.collect_vacancies_async(QUERY, max_concurrency=8, queue_size=10, **kwargs))
+    return collector.collect_vacancies(QUERY, max_workers=8, **kwargs)
+
+
+def fill_details(collector: Collector, engine: str, listing, **kwargs):
+    if engine == "async":
+        return asyncio.run(collector.fill_details_async(listing, max_concurrency=8, **kwargs))
+    return collector.fill_details(listing, max_workers=8, **kwargs)
+
+
+@pytest.mark.parametrize("engine", ["threads", "async"])
+def test_collect_vacancies(stub, engine):
+    collector, state = stub
+    df = collect(collector, engine).to_frame()
+
+    # Missing vacancies are dropped, failed ones are retried
+    expected = [str(i) for i in range(N_VACANCIES) if i not in state["missing"]]
+    assert df["Ids"].tolist() == expected
+    assert state["details"] == N_VACANCIES + 2
+    assert df["Keys"][0] == ["Python", "SQL"]
+    assert df["From"].notna().sum() == sum(1 for i in expected if int(i) % 2)
+
+
+@pytest.mark.parametrize("engine", ["threads", "async"])
+def test_fill_details(stub, engine):
+    collector, state = stub
+    listing = collector.collect_listing(QUERY)
+    assert listing.size == N_VACANCIES
+    assert state["details"] == 0
+
+    df = fill_details(collector, engine, listing).to_frame()
+    assert len(df) == N_VACANCIES - len(state["missing"])
+    assert df["Description"][0] == "Python developer with SQL skills, vacancy 0"
+
+
+@pytest.mark.parametrize("engine", ["threads", "async"])
+def test_callback_error_stops_collection(stub, engine):
+    collector, state = stub
+
+    def on_vacancy(job):
+        raise RuntimeError("stop")
+
+    start = time.perf_counter()
+    with pytest.raises(RuntimeError, match="stop"):
+        collect(collector, engine, on_vacancy=on_vacancy)
+    assert time.perf_counter() - start < 5
+    assert state["details"] < N_VACANCIES
+
+
+def test_async_cancellation(stub):
+    collector, state = stub
+
+    async def cancelled():
+        await asyncio.wait_for(collector.collect_vacancies_async(QUERY, max_concurrency=8, queue_size=10), 0.05)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(cancelled(), 5))